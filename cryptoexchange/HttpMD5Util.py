@@ -6,7 +6,11 @@ import http.client
 import urllib
 import json
 import hashlib
-import time
+
+#OKCOIN批量下单每次最多提交的订单数
+BATCH_ORDER_LIMIT = 5
+#批量下单最多同时发出的请求数
+BATCH_MAX_WORKERS = 4
 
 def buildMySign(params,secretKey):
     sign = ''
@@ -15,26 +19,58 @@ def buildMySign(params,secretKey):
     data = sign+'secret_key='+secretKey
     return  hashlib.md5(data.encode("utf8")).hexdigest().upper()
 
+#concurrent.futures和metrics在第一次使用时才导入，以加快import
 def httpGet(url,resource,params=''):
-    conn = http.client.HTTPSConnection(url, timeout=10)
-    conn.request("GET",resource + '?' + params)
-    response = conn.getresponse()
-    data = response.read().decode('utf-8')
-    return json.loads(data)
+    from .metrics import METRICS
+    with METRICS.timed('okcoin',resource.rstrip('?')):
+        conn = http.client.HTTPSConnection(url, timeout=10)
+        conn.request("GET",resource + '?' + params)
+        response = conn.getresponse()
+        data = response.read().decode('utf-8')
+        return json.loads(data)
 
 def httpPost(url,resource,params):
+     from .metrics import METRICS
      headers = {
             "Content-type" : "application/x-www-form-urlencoded",
      }
-     conn = http.client.HTTPSConnection(url, timeout=10)
-     temp_params = urllib.parse.urlencode(params)
-     conn.request("POST", resource, temp_params, headers)
-     response = conn.getresponse()
-     data = response.read().decode('utf-8')
-     params.clear()
-     conn.close()
-     return data
+     with METRICS.timed('okcoin',resource.rstrip('?')):
+         conn = http.client.HTTPSConnection(url, timeout=10)
+         temp_params = urllib.parse.urlencode(params)
+         conn.request("POST", resource, temp_params, headers)
+         response = conn.getresponse()
+         data = response.read().decode('utf-8')
+         params.clear()
+         conn.close()
+         return data
 
+#把订单列表序列化为orders_data参数
+def buildOrdersData(orders):
+    return json.dumps(orders,separators=(',',':'))
 
-        
-     
+#把订单列表按BATCH_ORDER_LIMIT分块并发提交，按输入顺序合并每个订单的结果
+#submit(orders_data)返回httpPost的原始响应
+def batchSubmit(submit,orders,limit=BATCH_ORDER_LIMIT,maxWorkers=None):
+    from concurrent.futures import ThreadPoolExecutor
+    orders = list(orders)
+    chunks = [orders[i:i + limit] for i in range(0, len(orders), limit)]
+    if not chunks:
+        return {'result':True,'order_info':[]}
+    with ThreadPoolExecutor(max_workers=min(maxWorkers or BATCH_MAX_WORKERS,len(chunks))) as executor:
+        futures = [executor.submit(submit,buildOrdersData(chunk)) for chunk in chunks]
+        orderInfo = []
+        result = True
+        for chunk,future in zip(chunks,futures):
+            try:
+                data = json.loads(future.result())
+            except Exception as e:
+                data = {'result':False,'error':str(e)}
+            info = data.get('order_info')
+            if not data.get('result') or info is None or len(info) != len(chunk):
+                result = False
+            if info is None or len(info) != len(chunk):
+                #结果条数与订单数不符时无法按位置对应，整块按失败处理
+                error = data.get('error_code',data.get('error'))
+                info = [{'order_id':-1,'error_code':error} for order in chunk]
+            orderInfo.extend(info)
+    return {'result':result,'order_info':orderInfo}
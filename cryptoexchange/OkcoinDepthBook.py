@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Locally maintained OKCoin order books fed by the websocket depth channels
+
+import bisect
+import re
+import zlib
+
+# ok_btcusd_depth, ok_btcusd_future_depth_this_week, ok_sub_futureusd_btc_depth_quarter_20
+DEPTH_CHANNEL = re.compile(r'^ok_(?:sub_(?:future|spot)usd_(?P<coin>[a-z]+)|(?P<symbol>[a-z]+)(?:_future)?)_depth'
+                           r'(?:_(?P<contract>this_week|next_week|month|quarter))?'
+                           r'(?:_(?P<size>\d+))?$')
+
+def parseDepthChannel(channel):
+    '''Return (symbol, contract, size) for a depth channel, or None.
+
+    contract is '' for spot books and size is None for incremental channels.'''
+    m = DEPTH_CHANNEL.match(channel)
+    if m is None:
+        return None
+    size = m.group('size')
+    symbol = m.group('symbol') or m.group('coin') + 'usd'
+    return (symbol, m.group('contract') or '',
+            int(size) if size else None)
+
+class BookSide(object):
+    '''One side of a book.
+
+    Prices are kept in an ascending list located with bisect and the
+    levels in a dict.  Changing the amount of an existing level is a dict
+    write; adding or removing a level also shifts the list, which is O(n)
+    in the number of levels but a single memmove for books of a few
+    hundred levels.  The best price is an end of the list and the top n
+    levels a slice.'''
+
+    def __init__(self, bids):
+        self.bids = bids
+        self.prices = []
+        self.levels = {}
+
+    def clear(self):
+        self.prices = []
+        self.levels = {}
+
+    def set(self, level):
+        rawPrice, rawAmount = level[0], level[1]
+        price = float(rawPrice)
+        amount = float(rawAmount)
+        if amount <= 0:
+            if self.levels.pop(price, None) is not None:
+                del self.prices[bisect.bisect_left(self.prices, price)]
+            return
+        if price not in self.levels:
+            bisect.insort(self.prices, price)
+        self.levels[price] = (amount, rawPrice, rawAmount)
+
+    def best(self):
+        if not self.prices:
+            return None
+        price = self.prices[-1] if self.bids else self.prices[0]
+        return (price, self.levels[price][0])
+
+    def top(self, n):
+        '''Best n levels as [(price, amount)], best first.'''
+        prices = self.prices[:-n - 1:-1] if self.bids else self.prices[:n]
+        return [(p, self.levels[p][0]) for p in prices]
+
+    def raw(self, n):
+        prices = self.prices[:-n - 1:-1] if self.bids else self.prices[:n]
+        return [self.levels[p][1:] for p in prices]
+
+    def __len__(self):
+        return len(self.prices)
+
+class OKCoinDepthBook(object):
+    '''Depth book for one (symbol, contract).'''
+
+    def __init__(self, symbol, contract=''):
+        self.symbol = symbol
+        self.contract = contract
+        self.bids = BookSide(True)
+        self.asks = BookSide(False)
+        self.timestamp = None
+        self.seeded = False
+        self.valid = True
+
+    def snapshot(self, data):
+        '''Replace the book with a full depth image. Returns False on a checksum mismatch.'''
+        self.bids.clear()
+        self.asks.clear()
+        self.seeded = True
+        self.valid = True
+        return self.update(data)
+
+    def update(self, data):
+        '''Apply changed levels. A zero amount removes the level.'''
+        for level in data.get('bids', ()):
+            self.bids.set(level)
+        for level in data.get('asks', ()):
+            self.asks.set(level)
+        self.timestamp = data.get('timestamp', self.timestamp)
+        if 'checksum' in data:
+            self.valid = self.checksum() == int(data['checksum'])
+        return self.valid
+
+    def best_bid(self):
+        return self.bids.best()
+
+    def best_ask(self):
+        return self.asks.best()
+
+    def spread(self):
+        bid = self.bids.best()
+        ask = self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return ask[0] - bid[0]
+
+    def depth(self, size=20):
+        '''Top of book in the layout of the REST future_depth reply.'''
+        return {'bids': self.bids.top(size),
+                'asks': self.asks.top(size),
+                'timestamp': self.timestamp}
+
+    def checksum(self, size=25):
+        '''Signed CRC32 of the best size levels, interleaved as
+        bid_price:bid_amount:ask_price:ask_amount, using the exchange's
+        own number formatting.'''
+        bids = self.bids.raw(size)
+        asks = self.asks.raw(size)
+        fields = []
+        for i in range(max(len(bids), len(asks))):
+            if i < len(bids):
+                fields.extend(bids[i])
+            if i < len(asks):
+                fields.extend(asks[i])
+        crc = zlib.crc32(':'.join(str(f) for f in fields).encode('utf-8'))
+        return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+class OKCoinDepthBooks(object):
+    '''Books per (symbol, contract) maintained from OKCoinWebsocket depth channels.
+
+    Fixed size channels (..._depth_this_week_20) push the whole book and
+    replace it; incremental channels are seeded by their first push and
+    updated afterwards.  When a checksum does not match the book is marked
+    invalid, onInvalid(book) is called and further increments are ignored
+    until a full image arrives or resync() reloads it over REST.'''
+
+    def __init__(self, onInvalid=None, onUpdate=None):
+        self.books = {}
+        self.onInvalid = onInvalid
+        self.onUpdate = onUpdate
+
+    def book(self, symbol, contract=''):
+        key = (symbol, contract)
+        book = self.books.get(key)
+        if book is None:
+            book = self.books[key] = OKCoinDepthBook(symbol, contract)
+        return book
+
+    def subscribe(self, ws, symbol, contract=''):
+        '''Subscribe ws to the incremental depth channel of symbol/contract.'''
+        if contract:
+            channel = 'ok_%s_future_depth_%s' % (symbol, contract)
+        else:
+            channel = 'ok_%s_depth' % symbol
+        ws.subscribe(channel, self.handle)
+        return self.book(symbol, contract)
+
+    def handle(self, channel, data):
+        parsed = parseDepthChannel(channel)
+        if parsed is None or not data:
+            return
+        symbol, contract, size = parsed
+        book = self.book(symbol, contract)
+        if size is not None or not book.seeded:
+            self.__publish(book, book.snapshot(data))
+        elif book.valid:
+            self.__publish(book, book.update(data))
+
+    def resync(self, book, rest, size=200):
+        '''Reload book from a REST OKCoinFuture (or OKCoinSpot for spot books).
+
+        onUpdate or onInvalid is called as for a websocket image.'''
+        symbol = book.symbol[:-3] + '_' + book.symbol[-3:]
+        if book.contract:
+            data = rest.future_depth(symbol, book.contract, str(size))
+        else:
+            data = rest.depth(symbol)
+        self.__publish(book, book.snapshot(data))
+        return book
+
+    def __publish(self, book, valid):
+        if not valid:
+            if self.onInvalid is not None:
+                self.onInvalid(book)
+        elif self.onUpdate is not None:
+            self.onUpdate(book)
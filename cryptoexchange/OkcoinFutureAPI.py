@@ -1,7 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 #用于访问OKCOIN 期货REST API
-from HttpMD5Util import buildMySign,httpGet,httpPost
+from .HttpMD5Util import buildMySign,httpGet,httpPost,batchSubmit
 
 class OKCoinFuture:
 
@@ -112,6 +112,12 @@ class OKCoinFuture:
         params['sign'] = buildMySign(params,self.__secretkey)
         return httpPost(self.__url,FUTURE_BATCH_TRADE,params)
 
+    #期货批量下单，orders为任意长度的订单列表，如[{'price':0.1,'amount':1,'type':1,'match_price':0}]
+    #自动按交易所上限分块并发提交，order_info按输入顺序返回
+    def future_batchTradeList(self,symbol,contractType,orders,leverRate,maxWorkers=None):
+        return batchSubmit(lambda ordersData: self.future_batchTrade(symbol,contractType,ordersData,leverRate),
+                           orders,maxWorkers=maxWorkers)
+
     #期货取消订单
     def future_cancel(self,symbol,contractType,orderId):
         FUTURE_CANCEL = "/api/v1/future_cancel.do?"
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Order entry over a persistent OKCoin websocket
+
+import collections
+import heapq
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import Future
+
+from .OkcoinWebsocket import buildMySign
+from .latency import LatencyStats
+
+class OrderTimeout(Exception):
+    pass
+
+class OrderEntryClosed(Exception):
+    pass
+
+class _Request(object):
+    __slots__ = ('channel', 'future', 'sent', 'deadline')
+
+    def __init__(self, channel, future, sent, deadline):
+        self.channel = channel
+        self.future = future
+        self.sent = sent
+        self.deadline = deadline
+
+class OKCoinOrderEntry(object):
+    '''Send orders and cancels over an OKCoinWebsocket and return a Future per request.
+
+    OKCoin replies on the channel of the request without echoing any
+    request id, and replies on one channel arrive in request order.  Each
+    channel therefore has a FIFO of outstanding requests and a reply
+    resolves the oldest one.  Once a request times out the FIFO can no
+    longer be trusted, as its reply may still come or may never come, so
+    every request pending on that channel fails with OrderTimeout and the
+    channel is out of step: replies are dropped and new requests fail at
+    once until the channel has been quiet for timeout seconds.
+
+    Futures resolve to the reply data, e.g. {'result': True, 'order_id': 1},
+    or to the error item for failed requests.  Acknowledgement latency per
+    channel is kept in self.latency.'''
+
+    def __init__(self, ws, timeout=5.0):
+        self.ws = ws
+        self.timeout = timeout
+        self.latency = {}
+        self.timeouts = 0
+        self.late = 0
+        self.__pending = {}
+        # channel -> time until which it is out of step
+        self.__stale = {}
+        self.__deadlines = []
+        self.__seq = itertools.count()
+        self.__lock = threading.Lock()
+        self.__cond = threading.Condition(self.__lock)
+        self.__sweeper = None
+        # chain to any close callback already set on the websocket
+        self.__onClose = ws.onClose
+        ws.onClose = self.__on_close
+
+    def request(self, channel, params, timeout=None):
+        '''Sign params, send them on channel and return a Future for the reply.'''
+        params = dict(params, api_key=self.ws.api_key)
+        params['sign'] = buildMySign(params, self.ws.secret_key)
+        message = json.dumps({'event': 'addChannel', 'channel': channel,
+                              'parameters': params, 'binary': 'true'})
+        future = Future()
+        with self.__cond:
+            queue = self.__pending.get(channel)
+            if queue is None:
+                queue = self.__pending[channel] = collections.deque()
+                self.latency[channel] = LatencyStats()
+                self.ws.on(channel, self.__reply)
+            now = time.time()
+            if self.__stale.get(channel, 0) > now:
+                future.set_exception(OrderTimeout("%s is out of step after a timeout" % channel))
+                return future
+            request = _Request(channel, future, now, now + (timeout or self.timeout))
+            # Enqueue and send under the lock so the FIFO matches wire order
+            queue.append(request)
+            heapq.heappush(self.__deadlines, (request.deadline, next(self.__seq), request))
+            try:
+                self.ws.send(message)
+            except Exception as e:
+                queue.pop()
+                future.set_exception(e)
+                return future
+            if self.__sweeper is None:
+                self.__sweeper = threading.Thread(target=self.__sweep)
+                self.__sweeper.daemon = True
+                self.__sweeper.start()
+            self.__cond.notify()
+        return future
+
+    def spotTrade(self, symbol, tradeType, price='', amount='', channel='ok_spotusd_trade', timeout=None):
+        params = {'symbol': symbol, 'type': tradeType}
+        if price:
+            params['price'] = price
+        if amount:
+            params['amount'] = amount
+        return self.request(channel, params, timeout)
+
+    def spotCancelOrder(self, symbol, orderId, channel='ok_spotusd_cancel_order', timeout=None):
+        return self.request(channel, {'symbol': symbol, 'order_id': orderId}, timeout)
+
+    def futureTrade(self, symbol, contractType, price='', amount='', tradeType='', matchPrice='',
+                    leverRate='', channel='ok_futuresusd_trade', timeout=None):
+        params = {
+            'symbol': symbol,
+            'contract_type': contractType,
+            'amount': amount,
+            'type': tradeType,
+            'match_price': matchPrice,
+            'lever_rate': leverRate
+        }
+        if price:
+            params['price'] = price
+        return self.request(channel, params, timeout)
+
+    def futureCancelOrder(self, symbol, orderId, contractType, channel='ok_futuresusd_cancel_order',
+                          timeout=None):
+        return self.request(channel, {'symbol': symbol, 'order_id': orderId,
+                                      'contract_type': contractType}, timeout)
+
+    def pending(self):
+        with self.__lock:
+            return sum(len(q) for q in self.__pending.values())
+
+    def stats(self):
+        return {channel: stats.summary() for channel, stats in list(self.latency.items())}
+
+    def __reply(self, channel, data):
+        now = time.time()
+        with self.__lock:
+            if self.__stale.get(channel, 0) > now:
+                # possibly the reply of a request that timed out
+                self.__stale[channel] = now + self.timeout
+                self.late += 1
+                return
+            queue = self.__pending.get(channel)
+            if not queue:
+                self.late += 1
+                return
+            request = queue.popleft()
+        self.latency[channel].add(now - request.sent)
+        _resolve(request.future, result=data)
+
+    def __sweep(self):
+        with self.__cond:
+            while True:
+                now = time.time()
+                while self.__deadlines and self.__deadlines[0][0] <= now:
+                    request = heapq.heappop(self.__deadlines)[2]
+                    if not request.future.done():
+                        self.__timeout(request, now)
+                if self.__deadlines:
+                    self.__cond.wait(self.__deadlines[0][0] - now)
+                else:
+                    self.__cond.wait()
+
+    def __timeout(self, request, now):
+        # Called with the lock held.  The replies still due on the channel
+        # can't be matched by position any more, fail them all.
+        self.timeouts += 1
+        channel = request.channel
+        queue = self.__pending[channel]
+        self.__pending[channel] = collections.deque()
+        self.__stale[channel] = now + self.timeout
+        _resolve(request.future, exception=OrderTimeout(
+            "No reply on %s after %.3fs" % (channel, now - request.sent)))
+        for other in queue:
+            _resolve(other.future, exception=OrderTimeout(
+                "%s is out of step after a timeout" % channel))
+
+    def __on_close(self):
+        with self.__lock:
+            queues = list(self.__pending.values())
+            self.__pending = {channel: collections.deque() for channel in self.__pending}
+        for queue in queues:
+            for request in queue:
+                _resolve(request.future, exception=OrderEntryClosed("OKCoin websocket closed"))
+        if self.__onClose is not None:
+            self.__onClose()
+
+def _resolve(future, result=None, exception=None):
+    # The caller may have cancelled the future in the meantime
+    if future.done():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except Exception:
+        pass
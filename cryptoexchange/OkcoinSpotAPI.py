@@ -1,7 +1,7 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 #用于访问OKCOIN 现货REST API
-from HttpMD5Util import buildMySign,httpGet,httpPost
+from .HttpMD5Util import buildMySign,httpGet,httpPost,batchSubmit
 
 class OKCoinSpot:
 
@@ -70,6 +70,12 @@ class OKCoinSpot:
         params['sign'] = buildMySign(params,self.__secretkey)
         return httpPost(self.__url,BATCH_TRADE_RESOURCE,params)
 
+    #现货批量下单，orders为任意长度的订单列表，如[{'price':0.1,'amount':0.2}]
+    #自动按交易所上限分块并发提交，order_info按输入顺序返回
+    def batchTradeList(self,symbol,tradeType,orders,maxWorkers=None):
+        return batchSubmit(lambda ordersData: self.batchTrade(symbol,tradeType,ordersData),
+                           orders,maxWorkers=maxWorkers)
+
     #现货取消订单
     def cancelOrder(self,symbol,orderId):
         CANCEL_ORDER_RESOURCE = "/api/v1/cancel_order.do"
@@ -1,4 +1,6 @@
 import websocket
+import threading
+import logging
 import time
 import sys
 import json
@@ -6,6 +8,8 @@ import hashlib
 import zlib
 import base64
 
+OKCOIN_WS_URL = "wss://real.okcoin.com:10440/websocket/okcoinapi"
+
 api_key=''
 secret_key = ""
 #business
@@ -136,6 +140,136 @@ def inflate(data):
     inflated += decompress.flush()
     return inflated
 
+class OKCoinWebsocket(object):
+    '''OKCoin websocket client.
+
+    OKCoin sends each binary frame as a complete raw deflate stream, so a
+    frame is inflated by a single zlib.decompress call, independently of
+    the others; a frame that doesn't inflate is logged and dropped.  The
+    text is handed to a bound JSONDecoder.decode; decoding the utf-8
+    explicitly measures faster than letting json.loads sniff the encoding
+    of bytes.  Every item of a reply carries a
+    'channel' key, which selects the handlers registered with on() by a
+    single dict lookup.  Handlers are called as handler(channel, data) on
+    the websocket thread; items without 'data' (error replies carrying
+    'errorcode') are passed whole.'''
+
+    def __init__(self, url=OKCOIN_WS_URL, api_key='', secret_key=''):
+        self.logger = logging.getLogger('root')
+        self.url = url
+        self.api_key = api_key
+        self.secret_key = secret_key
+        self.ws = None
+        self.wst = None
+        self.exited = False
+        # Called with (channel, data) for channels without a handler
+        self.defaultHandler = None
+        # Called with no arguments when the connection closes
+        self.onClose = None
+        self.__handlers = {}
+        self.__subscriptions = []
+        self.__decode = json.JSONDecoder().decode
+
+    def on(self, channel, handler):
+        '''Register handler(channel, data) for a channel.'''
+        self.__handlers.setdefault(channel, []).append(handler)
+
+    def off(self, channel, handler):
+        handlers = self.__handlers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self.__handlers.pop(channel, None)
+
+    def subscribe(self, channel, handler=None, parameters=None):
+        '''Subscribe to a channel.
+
+        There is no automatic reconnect; subscriptions are kept and sent
+        again by every later connect().'''
+        if handler is not None:
+            self.on(channel, handler)
+        message = {'event':'addChannel','channel':channel,'binary':'true'}
+        if parameters:
+            message['parameters'] = parameters
+        message = json.dumps(message)
+        self.__subscriptions.append(message)
+        if self.connected():
+            self.send(message)
+
+    def send(self, message):
+        self.ws.send(message)
+
+    def connected(self):
+        return self.ws is not None and self.ws.sock is not None and self.ws.sock.connected
+
+    def connect(self, timeout=5):
+        '''Connect to the websocket in a thread.'''
+        self.exited = False
+        self.ws = websocket.WebSocketApp(self.url,
+                                         on_message=self.__on_message,
+                                         on_error=self.__on_error,
+                                         on_close=self.__on_close,
+                                         on_open=self.__on_open)
+        self.wst = threading.Thread(target=lambda: self.ws.run_forever())
+        self.wst.daemon = True
+        self.wst.start()
+        while not self.connected() and timeout > 0:
+            time.sleep(0.1)
+            timeout -= 0.1
+        if not self.connected():
+            self.logger.error("Couldn't connect to OKCoin websocket.")
+            self.exit()
+            return False
+        return True
+
+    def exit(self):
+        self.exited = True
+        if self.ws is not None:
+            self.ws.close()
+
+    def dispatch(self, message):
+        '''Decode a raw frame and route each item to its channel handlers.'''
+        if not isinstance(message, str):
+            try:
+                message = zlib.decompress(message, -zlib.MAX_WBITS).decode('utf-8')
+            except zlib.error as e:
+                self.logger.warning("Dropping undecodable OKCoin frame of %d bytes: %s",
+                                    len(message), e)
+                return
+        items = self.__decode(message)
+        if isinstance(items, dict):
+            items = [items]
+        handlers = self.__handlers
+        for item in items:
+            channel = item.get('channel')
+            callbacks = handlers.get(channel)
+            if callbacks is not None:
+                data = item.get('data', item)
+                for callback in callbacks:
+                    callback(channel, data)
+            elif self.defaultHandler is not None:
+                self.defaultHandler(channel, item.get('data', item))
+
+    def __on_message(self, ws, message):
+        try:
+            self.dispatch(message)
+        except Exception:
+            self.logger.exception("Error handling OKCoin message")
+
+    def __on_open(self, ws):
+        self.logger.debug("OKCoin websocket opened.")
+        for message in self.__subscriptions:
+            ws.send(message)
+
+    def __on_error(self, ws, error):
+        if not self.exited:
+            self.logger.error("OKCoin websocket error : %s" % error)
+
+    def __on_close(self, ws, *args):
+        self.logger.info('OKCoin websocket closed')
+        if self.onClose is not None:
+            self.onClose()
+
 def on_error(self,evt):
     print (evt)
 
@@ -143,7 +277,7 @@ def on_close(self,evt):
     print ('DISCONNECT')
 
 if __name__ == "__main__":
-    url = "wss://real.okcoin.com:10440/websocket/okcoinapi"      #if okcoin.cn  change url wss://real.okcoin.cn:10440/websocket/okcoinapi
+    url = OKCOIN_WS_URL      #if okcoin.cn  change url wss://real.okcoin.cn:10440/websocket/okcoinapi
     api_key='your api_key which you apply'
     secret_key = "your secret_key which you apply"
 
@@ -1 +1,55 @@
 # module file for cryptoexchange
+#
+# Submodules and their dependencies (requests, websocket-client, numpy)
+# are only imported when one of the names below is first used, so
+# "import cryptoexchange" itself costs almost nothing.
+
+import importlib
+
+# public name -> submodule defining it
+_EXPORTS = {
+    'OKCoinSpot': 'OkcoinSpotAPI',
+    'OKCoinFuture': 'OkcoinFutureAPI',
+    'OKCoinWebsocket': 'OkcoinWebsocket',
+    'OKCoinOrderEntry': 'OkcoinOrderEntry',
+    'OKCoinDepthBook': 'OkcoinDepthBook',
+    'OKCoinDepthBooks': 'OkcoinDepthBook',
+    'BitMEX': 'bitmex',
+    'BarBuilder': 'bars',
+    'BitMEXWebsocket': 'bitmex_ws',
+    'BitMEXMultiplexWebsocket': 'bitmex_mux',
+    'MarketDataPublisher': 'bitmex_shm',
+    'HistoryDownloader': 'bitmex_history',
+    'MarketDataReader': 'bitmex_shm',
+    'Client796': 'api796',
+    'get_data': 'bitfutures',
+    'FuturesCurveEngine': 'bitfutures_stream',
+    'ConsolidatedBook': 'consolidated',
+    'Conflator': 'conflation',
+    'InstrumentRegistry': 'instruments',
+    'REGISTRY': 'instruments',
+    'CALENDAR': 'instruments',
+    'RateProvider': 'fxrate',
+    'USDCNY': 'fxrate',
+    'CurveHistory': 'history',
+    'CurveHistoryWriter': 'history',
+    'LatencyStats': 'latency',
+    'RateLimiter': 'ratelimit',
+    'METRICS': 'metrics',
+    'OrderLatencyTracer': 'order_tracer',
+    'OrderManager': 'order_manager',
+    'start_queue_logging': 'logqueue',
+}
+
+__all__ = sorted(_EXPORTS)
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    value = getattr(importlib.import_module('.' + module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
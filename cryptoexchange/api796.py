@@ -15,26 +15,35 @@ import hashlib
 import hmac
 import http.client
 import json
+import logging
 import os
+import threading
 
-def get_796_token(appid,apikey,secretkey):
-    timestamp = time.time()#"1414142919" #time.time()
+try:
+    from .metrics import METRICS
+except ImportError:
+    # run as a script, for the demo below
+    from metrics import METRICS
+
+def sign_796(appid,apikey,secretkey,timestamp):
     params = {"apikey": apikey, "appid": appid, "secretkey": secretkey, "timestamp": str(timestamp)}
     params = sorted(iter(params.items()), key=lambda d: d[0], reverse=False)
     message = urllib.parse.urlencode(params)
-    print("secretkey=",secretkey)
-    print("message=",message)
     s = hmac.new(secretkey.encode('utf-8'),
                  message.encode('utf-8'),
                  digestmod=hashlib.sha1).hexdigest()
-    print("hex=",s)
-    sig = base64.b64encode(s.encode('utf-8'))
-    print("sig=",sig)
+    return base64.b64encode(s.encode('utf-8'))
 
+def token_request_796(appid,apikey,secretkey):
+    """Path and query of a signed access token request."""
+    timestamp = time.time()
+    sig = sign_796(appid,apikey,secretkey,timestamp)
     payload = urllib.parse.urlencode({'appid': appid, 'apikey': apikey, 'timestamp': timestamp, 'sig': sig})
+    return "/oauth/token?"+payload
 
+def get_796_token(appid,apikey,secretkey):
     c = http.client.HTTPSConnection('796.com')
-    c.request("GET", "/oauth/token?"+payload)
+    c.request("GET", token_request_796(appid,apikey,secretkey))
     r = c.getresponse()
 
     if r.status == 200:
@@ -45,7 +54,153 @@ def get_796_token(appid,apikey,secretkey):
             return jsonDict['data']['access_token']
     return None
 
+class Client796(object):
+
+    """796 client that caches its access token and keeps connections alive.
+
+    The token is reused until shortly before it expires and is renewed by
+    a background timer, so an account call is a single request on an
+    already open connection.  Each host has one keep-alive connection,
+    reopened when the server drops it."""
+
+    MARKET_HOST = 'api.796.com'
+    ACCOUNT_HOST = '796.com'
+
+    def __init__(self, appid=None, apikey=None, secretkey=None,
+                 token_ttl=3600, refresh_margin=300, timeout=20):
+        self.logger = logging.getLogger('root')
+        self.appid = appid
+        self.apikey = apikey
+        self.secretkey = secretkey
+        self.token_ttl = token_ttl
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self.__token = None
+        self.__expires = 0
+        self.__timer = None
+        self.__connections = {}
+        self.__lock = threading.Lock()
+        # guards token and expiry; reentrant as token() may refresh
+        self.__token_lock = threading.RLock()
+
+    def __connection(self, host):
+        conn = self.__connections.get(host)
+        if conn is None:
+            if host == self.MARKET_HOST:
+                conn = http.client.HTTPConnection(host, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+            self.__connections[host] = conn
+        return conn
+
+    def _request(self, host, path, params=None):
+        """GET path on host over the keep-alive connection and decode the json."""
+        endpoint = path.split('?')[0]
+        if params:
+            path += '?' + urllib.parse.urlencode(params)
+        with self.__lock:
+            for attempt in (0, 1):
+                conn = self.__connection(host)
+                start = time.perf_counter()
+                try:
+                    conn.request("GET", path, headers={'Connection': 'keep-alive'})
+                    r = conn.getresponse()
+                    data = r.read()
+                    break
+                except (http.client.HTTPException, OSError) as e:
+                    METRICS.record('796', endpoint, time.perf_counter() - start,
+                                   type(e).__name__, retry=not attempt)
+                    conn.close()
+                    del self.__connections[host]
+                    if attempt:
+                        raise
+        if r.status != 200:
+            METRICS.record('796', endpoint, time.perf_counter() - start, 'HTTP %s' % r.status)
+            raise IOError("796 request failed with HTTP %s: %s" % (r.status, endpoint))
+        METRICS.record('796', endpoint, time.perf_counter() - start)
+        return json.loads(data.decode('utf-8'))
 
+    #
+    # Access token
+    #
+    def token(self):
+        """Current access token, fetched only if there is none or it expired."""
+        with self.__token_lock:
+            if self.__token is None or time.time() >= self.__expires:
+                return self.refresh_token()
+            return self.__token
+
+    def refresh_token(self):
+        with self.__token_lock:
+            jsonDict = self._request(self.ACCOUNT_HOST,
+                                     token_request_796(self.appid, self.apikey, self.secretkey))
+            if jsonDict.get('errno') != "0":
+                raise IOError("796 token request failed: %s" % jsonDict.get('msg'))
+            data = jsonDict['data']
+            ttl = float(data.get('expires_in') or self.token_ttl)
+            self.__token = data['access_token']
+            self.__expires = time.time() + ttl
+            self.__schedule(max(ttl - self.refresh_margin, 1))
+            return self.__token
+
+    def __schedule(self, delay):
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__timer = threading.Timer(delay, self.__background_refresh)
+        self.__timer.daemon = True
+        self.__timer.start()
+
+    def __background_refresh(self):
+        try:
+            self.refresh_token()
+        except Exception:
+            self.logger.warning("Unable to refresh 796 access token", exc_info=True)
+            self.__schedule(30)
+
+    def close(self):
+        if self.__timer is not None:
+            self.__timer.cancel()
+        with self.__lock:
+            for conn in self.__connections.values():
+                conn.close()
+            self.__connections = {}
+
+    def _account(self, path, params=None):
+        params = dict(params or {})
+        for attempt in (0, 1):
+            params['access_token'] = self.token()
+            jsonDict = self._request(self.ACCOUNT_HOST, path, params)
+            # -102: access token repealed, get a new one and retry once
+            if jsonDict.get('errno') == "-102" and not attempt:
+                with self.__token_lock:
+                    if self.__token == params['access_token']:
+                        self.__token = None
+                continue
+            return jsonDict
+
+    #
+    # Market data
+    #
+    def ticker(self, type='weekly'):
+        return self._request(self.MARKET_HOST, "/v3/futures/ticker.html", {'type': type})
+
+    def depth(self, type='weekly'):
+        return self._request(self.MARKET_HOST, "/v3/futures/depth.html", {'type': type})
+
+    def trades(self, type='weekly'):
+        return self._request(self.MARKET_HOST, "/v3/futures/trades.html", {'type': type})
+
+    #
+    # Account
+    #
+    def get_info(self):
+        return self._account("/v1/user/get_info")
+
+    def get_balance(self):
+        return self._account("/v1/user/get_balance")
+
+    def get_assets(self):
+        return self._account("/v1/user/get_assets")
 
 def getUserInfo(sAccessToken):
     sUrl = "/v1/user/get_info?access_token=%s" % (sAccessToken)
@@ -96,8 +251,12 @@ if __name__ == "__main__":
     access_token = get_796_token(appid = app_id,
                                  apikey=api_key,
                                  secretkey=api_secret)
-    print("access_token=",access_token)
     getUserInfo(access_token)
     getUserInfo1(access_token)
     getUserInfo2(access_token)
     getUserInfoError(access_token)
+
+    client = Client796(app_id, api_key, api_secret)
+    print(client.ticker())
+    print(client.get_info())
+    client.close()
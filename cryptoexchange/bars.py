@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""OHLCV bars of several resolutions built incrementally from trades.
+
+Each resolution keeps the bar in progress as a handful of floats, so a
+trade costs a constant amount of work per resolution whatever the
+history length.  When a trade falls into a later bar, the finished bar
+is written into a fixed-size numpy ring buffer and the bar-close
+callbacks are called.  Periods without trades produce no bars.
+
+BarBuilder.attach_bitmex() and attach_okcoin() feed a builder from the
+BitMEXWebsocket trade table and the OKCoin trade channels."""
+
+import threading
+import time
+
+import numpy as np
+
+from .instruments import parse_timestamp
+
+BAR_DTYPE = np.dtype([('start', '<f8'),
+                      ('open', '<f8'),
+                      ('high', '<f8'),
+                      ('low', '<f8'),
+                      ('close', '<f8'),
+                      ('volume', '<f8'),
+                      ('vwap', '<f8'),
+                      ('trades', '<i8')])
+
+class BarSeries(object):
+
+    """Bars of one resolution: the bar in progress and a ring of finished bars."""
+
+    def __init__(self, seconds, capacity=1000):
+        self.seconds = seconds
+        self.ring = np.zeros(capacity, dtype=BAR_DTYPE)
+        # number of bars finished so far; the newest is at (count - 1) % capacity
+        self.count = 0
+        self.start = None
+        # start of the newest finished bar
+        self.last = None
+        # trades dropped because their bar had already started or finished
+        self.late = 0
+
+    def add(self, t, price, size):
+        """Add a trade at t seconds since the epoch. Returns the bar it finished, if any.
+
+        A trade older than the bar in progress, or falling in a bar already
+        finished, is dropped and counted in late, so that bar starts stay
+        unique and increasing."""
+        start = t - t % self.seconds
+        finished = None
+        if self.start is not None and start < self.start or \
+           self.last is not None and start <= self.last:
+            self.late += 1
+            return None
+        if self.start is None or start > self.start:
+            if self.start is not None:
+                finished = self.finish()
+            self.start = start
+            self.open = self.high = self.low = price
+            self.volume = self.notional = 0.0
+            self.trades = 0
+        elif price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        self.volume += size
+        self.notional += price * size
+        self.trades += 1
+        return finished
+
+    def finish(self):
+        """Move the bar in progress into the ring and return a copy of it."""
+        if self.start is None:
+            return None
+        bar = self.ring[self.count % len(self.ring)]
+        bar['start'] = self.start
+        bar['open'] = self.open
+        bar['high'] = self.high
+        bar['low'] = self.low
+        bar['close'] = self.close
+        bar['volume'] = self.volume
+        bar['vwap'] = self.notional / self.volume if self.volume else self.close
+        bar['trades'] = self.trades
+        self.count += 1
+        self.last = self.start
+        self.start = None
+        return bar.copy()
+
+    def current(self):
+        """The bar in progress as a dict, or None."""
+        if self.start is None:
+            return None
+        return {'start': self.start, 'open': self.open, 'high': self.high, 'low': self.low,
+                'close': self.close, 'volume': self.volume,
+                'vwap': self.notional / self.volume if self.volume else self.close,
+                'trades': self.trades}
+
+    def history(self, n=None):
+        """Copy of the last n finished bars (all those held by default), oldest first."""
+        held = min(self.count, len(self.ring))
+        n = held if n is None else min(n, held)
+        return self.ring[np.arange(self.count - n, self.count) % len(self.ring)]
+
+class BarBuilder(object):
+
+    """Bars of several resolutions (in seconds) for one instrument.
+
+    Callbacks registered with on_bar() are called as fn(seconds, bar)
+    after a bar closes, bar being a BAR_DTYPE record."""
+
+    def __init__(self, resolutions=(1, 60, 300), capacity=1000):
+        self.lock = threading.Lock()
+        self.series = {seconds: BarSeries(seconds, capacity) for seconds in resolutions}
+        self.__series = list(self.series.values())
+        self.__callbacks = []
+
+    def on_bar(self, fn):
+        self.__callbacks.append(fn)
+
+    def remove_on_bar(self, fn):
+        self.__callbacks.remove(fn)
+
+    def add(self, t, price, size):
+        """Add a trade at t seconds since the epoch to every resolution."""
+        finished = []
+        with self.lock:
+            for series in self.__series:
+                bar = series.add(t, price, size)
+                if bar is not None:
+                    finished.append((series.seconds, bar))
+        self.__notify(finished)
+
+    def flush(self, now=None):
+        """Close the bars that ended before now, for when trades are sparse."""
+        if now is None:
+            now = time.time()
+        finished = []
+        with self.lock:
+            for series in self.__series:
+                if series.start is not None and series.start + series.seconds <= now:
+                    finished.append((series.seconds, series.finish()))
+        self.__notify(finished)
+
+    def __notify(self, finished):
+        for seconds, bar in finished:
+            for fn in self.__callbacks:
+                fn(seconds, bar)
+
+    def history(self, seconds, n=None):
+        return self.series[seconds].history(n)
+
+    def current(self, seconds):
+        with self.lock:
+            return self.series[seconds].current()
+
+    #
+    # Sources
+    #
+    def attach_bitmex(self, ws, symbol=None):
+        """Build bars from the trade inserts of a BitMEXWebsocket.
+
+        The trades of the initial partial are history and are skipped."""
+        symbol = symbol or ws.symbol
+        def listener(table, action, rows):
+            if table == 'trade' and action == 'insert':
+                for row in rows:
+                    if row['symbol'] == symbol:
+                        self.add(parse_timestamp(row['timestamp']), row['price'], row['size'])
+        ws.add_listener(listener)
+        return listener
+
+    def attach_okcoin(self, okws, channel="ok_btcusd_trades_v1"):
+        """Build bars from an OKCoin trade channel.
+
+        OKCoin trade times carry no date or time zone, so trades are
+        stamped with their arrival time."""
+        okws.subscribe(channel, self.okcoin_trades)
+
+    def okcoin_trades(self, channel, data):
+        # [tid, price, amount, time, type] per trade
+        if not isinstance(data, list):
+            return
+        now = time.time()
+        for trade in data:
+            self.add(now, float(trade[1]), float(trade[2]))
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Vectorized basis and premium computations over bitfutures.get_data snapshots.
+
+curve_table() flattens a snapshot into one structured array with a row
+per exchange and expiry and days to expiry precomputed; stack() joins
+many snapshots so the functions below analyse all of them in one pass."""
+
+import time
+import numpy as np
+
+CURVE_DTYPE = np.dtype([('snapshot', 'i4'),
+                        ('timestamp', 'f8'),
+                        ('exchange', 'U8'),
+                        ('contract', 'U4'),
+                        ('expiry', 'M8[D]'),
+                        ('days', 'f8'),
+                        ('bid', 'f8'),
+                        ('ask', 'f8'),
+                        ('last', 'f8'),
+                        ('spot', 'f8')])
+
+SPREAD_DTYPE = np.dtype([('snapshot', 'i4'),
+                         ('near_exchange', 'U8'),
+                         ('far_exchange', 'U8'),
+                         ('near_expiry', 'M8[D]'),
+                         ('far_expiry', 'M8[D]'),
+                         ('spread', 'f8'),
+                         ('executable', 'f8')])
+
+def curve_table(data, timestamp=None, snapshot=0, spot='bitfinex'):
+    """Flatten a get_data snapshot into a CURVE_DTYPE array."""
+    if timestamp is None:
+        timestamp = time.time()
+    futures = data['futures']
+    n = sum(len(entry['dates']) for entry in futures.values())
+    table = np.zeros(n, dtype=CURVE_DTYPE)
+    i = 0
+    for exchange, entry in futures.items():
+        j = i + len(entry['dates'])
+        table['exchange'][i:j] = exchange
+        table['contract'][i:j] = entry.get('contract', 'XBT')
+        table['expiry'][i:j] = [str(d)[:10] for d in entry['dates']]
+        table['bid'][i:j] = np.asarray(entry['bids'], dtype=float)
+        table['ask'][i:j] = np.asarray(entry['asks'], dtype=float)
+        table['last'][i:j] = np.asarray(entry['last'], dtype=float)
+        i = j
+    table['snapshot'] = snapshot
+    table['timestamp'] = timestamp
+    table['spot'] = float(data['spot'].get(spot) or 'nan')
+    table['days'] = (table['expiry'].astype('M8[s]').astype('f8') - timestamp) / 86400.0
+    return table
+
+def stack(snapshots, timestamps=None):
+    """Concatenate many get_data snapshots (or curve tables) into one table."""
+    tables = []
+    for k, data in enumerate(snapshots):
+        if isinstance(data, np.ndarray):
+            table = data.copy()
+            table['snapshot'] = k
+        else:
+            table = curve_table(data, None if timestamps is None else timestamps[k], k)
+        tables.append(table)
+    if not tables:
+        return np.zeros(0, dtype=CURVE_DTYPE)
+    return np.concatenate(tables)
+
+def price(table, kind='mid'):
+    """'mid', 'bid', 'ask' or 'last' price of every row."""
+    if kind == 'mid':
+        return (table['bid'] + table['ask']) / 2.0
+    return table[kind]
+
+def basis(table, kind='mid'):
+    """Futures price minus spot."""
+    return price(table, kind) - table['spot']
+
+def annualized_premium(table, kind='mid'):
+    """Premium over spot annualized by days to expiry. nan for expired rows."""
+    days = np.where(table['days'] > 0, table['days'], np.nan)
+    return (price(table, kind) / table['spot'] - 1.0) * 365.0 / days
+
+def calendar_spreads(table):
+    """Spreads between every pair of rows of a snapshot with different expiries.
+
+    spread is far mid minus near mid, executable is far bid minus near
+    ask, i.e. the price of selling the far contract and buying the near
+    one.  Pairs span exchanges as well as expiries."""
+    order = np.argsort(table['snapshot'], kind='stable')
+    table = table[order]
+    n = len(table)
+    if n == 0:
+        return np.zeros(0, dtype=SPREAD_DTYPE)
+    snapshots, starts, counts = np.unique(table['snapshot'], return_index=True,
+                                          return_counts=True)
+    group = np.searchsorted(snapshots, table['snapshot'])
+    width = counts[group]
+    # all (left, right) row pairs within each snapshot
+    left = np.repeat(np.arange(n), width)
+    offset = np.arange(len(left)) - np.repeat(np.cumsum(width) - width, width)
+    right = np.repeat(starts[group], width) + offset
+    keep = table['expiry'][right] > table['expiry'][left]
+    near = table[left[keep]]
+    far = table[right[keep]]
+    spreads = np.zeros(len(near), dtype=SPREAD_DTYPE)
+    spreads['snapshot'] = near['snapshot']
+    spreads['near_exchange'] = near['exchange']
+    spreads['far_exchange'] = far['exchange']
+    spreads['near_expiry'] = near['expiry']
+    spreads['far_expiry'] = far['expiry']
+    spreads['spread'] = price(far) - price(near)
+    spreads['executable'] = far['bid'] - near['ask']
+    return spreads
+
+def to_frame(table):
+    """Convert a table from this module into a pandas DataFrame."""
+    import pandas as pd
+    return pd.DataFrame.from_records(table)
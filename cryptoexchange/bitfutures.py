@@ -2,27 +2,25 @@
 # Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
 # Released under the Simplified BSD License
 
-import datetime
+# Part of the cryptoexchange package; run the demo below with
+#     python3 -m cryptoexchange.bitfutures
+
+# numpy and requests are imported when first needed, so that importing
+# this module stays cheap for tools that never call get_data
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .instruments import CALENDAR, REGISTRY
+from .fxrate import USDCNY
+from .metrics import METRICS
+
 def weekly_expiry():
-    d = datetime.date.today()
-    while d.weekday() != 5:
-        d += datetime.timedelta(1)
-    return d
+    return CALENDAR.weekly()
 
 def  quarter_expiry():
-    ref = datetime.date.today()
-    if ref.month < 4:
-        d = datetime.date(ref.year, 3, 31)
-    elif ref.month < 7:
-        d = datetime.date(ref.year, 6, 30)
-    elif ref.month < 10:
-        d = datetime.date(ref.year, 9, 30)
-    else:
-        d= datetime.date(ref.year, 12, 31)
-    while d.weekday() != 5:
-        d -= datetime.timedelta(1)
-    return d
-quarter_expiry()
+    return CALENDAR.quarterly()
 
 def date_stamp(d):
     return d.strftime("%Y-%m-%d")
@@ -30,31 +28,78 @@ def date_stamp(d):
 def time_stamp(d):
     return d.strftime("%H:%M:%S")
 
-import json
-import requests
-import dateutil.parser
-import pprint
-import numpy as np
 
-#usdcny = requests.get('http://rate-exchange.appspot.com/currency?from=USD&to=CNY').json()['rate']
-usdcny = 6.41
+OKCOIN_CONTRACTS = ["this_week", "next_week", "month", "quarter"]
+BITVC_CONTRACTS = ["week", "next_week", "quarter"]
+POOL_SIZE = 16
+# seconds before a request gives up
+REQUEST_TIMEOUT = 10
+# seconds a cached exchange is served without refetching
+CACHE_TTL = 2.0
+# seconds get_data waits for refreshes before serving stale values
+DEADLINE = 3.0
 
+_session = None
+_executor = None
+_pool_lock = threading.Lock()
 
+def _pool():
+    """Shared keep-alive session and thread pool used by get_data."""
+    global _session, _executor
+    with _pool_lock:
+        if _session is None:
+            import requests
+            import requests.adapters
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE,
+                                                    pool_maxsize=POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+            _executor = ThreadPoolExecutor(max_workers=POOL_SIZE)
+    return _session, _executor
 
-def get_data(exchanges=None):
-    retval = {}
-    expiry = {}
-    futures = {}
-    expiry['week'] = weekly_expiry()
-    expiry['next_week'] = weekly_expiry() + datetime.timedelta(7)
-    expiry['quarter'] = quarter_expiry()
-    retval['spot'] = {}
+def _get(exchange, url, params=None):
+    """Start a GET on the shared pool and return a future for the decoded json."""
+    session, executor = _pool()
+    endpoint = url.split('?')[0].split('/', 3)[-1]
+    def get():
+        with METRICS.timed(exchange, endpoint):
+            response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+    return executor.submit(get)
+
+# Each fetcher starts all of its requests and returns them with a function
+# that assembles the exchange's entries once they complete, so every
+# request of every exchange is in flight at the same time.
+
+_numpy = None
 
-    bitFinexTick = requests.get("https://api.bitfinex.com/v1/ticker/btcusd")
-    retval['spot']['bitfinex'] = bitFinexTick.json()['last_price']
-    #bitmex
-    if (exchanges == None or "bitmex" in exchanges):
-        data = requests.get('https://www.bitmex.com:443/api/v1/instrument/active').json()
+def _np():
+    """The numpy module, imported on first use."""
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+    return _numpy
+
+def _array(values):
+    return _np().array(values)
+
+def bitfinex_ticker(symbol="btcusd"):
+    """Start a request for a Bitfinex ticker and return a future for its dict."""
+    return _get("bitfinex", "https://api.bitfinex.com/v1/ticker/" + symbol)
+
+def _fetch_bitfinex():
+    tick = bitfinex_ticker()
+    return [tick], lambda: {'bitfinex': tick.result()['last_price']}
+
+def _fetch_bitmex():
+    response = _get('bitmex', 'https://www.bitmex.com:443/api/v1/instrument/active')
+    leaves = [response]
+    def assemble():
+        data = response.result()
         symbols = []
         dates = []
         bids = []
@@ -64,84 +109,194 @@ def get_data(exchanges=None):
         for contracttype in ["XBU", "XBT"]:
             for i in data:
                 if i['rootSymbol'] == contracttype and i['buyLeg'] == "":
-                    dates.append(date_stamp(dateutil.parser.parse(i['expiry'])))
+                    dates.append(date_stamp(REGISTRY.bitmex(i).expiry))
                     symbols.append(i['symbol'])
                     bids.append(i['bidPrice'])
                     asks.append(i['askPrice'])
                     last.append(i['lastPrice'])
                     contract.append(contracttype)
-                futures["bitmex"] = {
-                    "contract" : contract,
-                    "dates": dates,
-                    "bids" : np.array(bids),
-                    "asks" : np.array(asks),
-                    "last" : np.array(last)
-                    }
-        #okcoin
-    if (exchanges == None or "okcoin" in exchanges):
-        symbols = []
+        return {"bitmex" : {
+            "symbols" : symbols,
+            "contract" : contract,
+            "dates": dates,
+            "bids" : _array(bids),
+            "asks" : _array(asks),
+            "last" : _array(last)
+            }}
+    return leaves, assemble
+
+def _fetch_okcoin():
+    responses = [_get('okcoin', 'https://www.okcoin.com/api/future_ticker.do',
+                      params={"symbol": "btc_usd", "contractType": i})
+                 for i in OKCOIN_CONTRACTS]
+    leaves = responses
+    def assemble():
         dates = []
         bids = []
         asks = []
         last = []
         contract = []
-        for i in ["this_week", "next_week", "month", "quarter"]:
-            response = requests.get('https://www.okcoin.com/api/future_ticker.do',
-                                    params={"symbol": "btc_usd",
-                                        "contractType":
-                                            i})
-            data = response.json()["ticker"][0]
-            d = datetime.date(int(str(data['contractId'])[0:4]),
-                              int(str(data['contractId'])[4:6]),
-                              int(str(data['contractId'])[6:8]))
-            dates.append(date_stamp(d))
+        for i, response in zip(OKCOIN_CONTRACTS, responses):
+            data = response.result()["ticker"][0]
+            dates.append(date_stamp(REGISTRY.okcoin(data['contractId'], i).expiry))
             bids.append(data["buy"])
             asks.append(data['sell'])
             last.append(data['last'])
             contract.append("XBT")
-            futures['okcoin'] = {"dates": dates,
-                                 "contract" : contract,
-                                 "bids" : np.array(bids),
-                                 "asks" : np.array(asks),
-                                 "last": np.array(last)}
-    #796
-    if (exchanges == None or "796" in exchanges):
-        data = requests.get("http://api.796.com/v3/futures/ticker.html?type=weekly").json()['ticker']
-        futures['796'] = {'dates':[date_stamp(weekly_expiry())],
-                          "contract" : ["XBT"],
-                          "bids" : np.array([float(data['buy'])]),
-                          "asks" : np.array([float(data['sell'])]),
-                          "last" : np.array([float(data['last'])])}
-        data = requests.get("http://api.796.com/v3/futures/ticker.html?type=btccnyweeklyfutures").json()['ticker']
+        return {"okcoin" : {"dates": dates,
+                            "contract" : contract,
+                            "bids" : _array(bids),
+                            "asks" : _array(asks),
+                            "last": _array(last)}}
+    return leaves, assemble
+
+def _fetch_796():
+    weekly = _get("796", "http://api.796.com/v3/futures/ticker.html?type=weekly")
+    cny = _get("796", "http://api.796.com/v3/futures/ticker.html?type=btccnyweeklyfutures")
+    leaves = [weekly, cny]
+    def assemble():
+        retval = {}
+        data = weekly.result()['ticker']
+        retval['796'] = {'dates':[date_stamp(weekly_expiry())],
+                         "contract" : ["XBT"],
+                         "bids" : _array([float(data['buy'])]),
+                         "asks" : _array([float(data['sell'])]),
+                         "last" : _array([float(data['last'])])}
+        data = cny.result()['ticker']
         if float(data['buy']) > 0.0 and float(data['sell']) > 0.0:
-            futures['796CNY'] = {'dates':[weekly_expiry()],
-                                 "bids" :
-        np.array([float(data['buy'])/usdcny]),
-                                 "asks" :
-        np.array([float(data['sell'])/usdcny]),
-                                 "last" :
-        np.array([float(data['last'])/usdcny])}
-    # bitvc
-    if (exchanges == None or "bitvc" in exchanges):
+            rate = USDCNY.rate
+            retval['796CNY'] = {'dates':[weekly_expiry()],
+                                "bids" : USDCNY.convert([data['buy']], rate),
+                                "asks" : USDCNY.convert([data['sell']], rate),
+                                "last" : USDCNY.convert([data['last']], rate)}
+        return retval
+    return leaves, assemble
+
+def _fetch_bitvc():
+    responses = [_get('bitvc', 'http://market.bitvc.com/futures/ticker_btc_' + i + '.js')
+                 for i in BITVC_CONTRACTS]
+    leaves = responses
+    def assemble():
         dates= []
         bids = []
         asks = []
         last = []
         contract = []
-        for i in ["week", "next_week", "quarter"]:
-            data = requests.get('http://market.bitvc.com/futures/ticker_btc_' + i + '.js').json()
-            dates.append(date_stamp(expiry[i]))
+        for i, response in zip(BITVC_CONTRACTS, responses):
+            data = response.result()
+            dates.append(date_stamp(REGISTRY.relative('bitvc', i).expiry))
             bids.append(data['buy'])
             asks.append(data['sell'])
             last.append(data['last'])
             contract.append("XBT")
-        futures['bitvc'] = {'dates':dates,
-                            "bids" : np.array(bids).astype(float)/usdcny,
-                            "asks" : np.array(asks).astype(float)/usdcny,
-                            "last" : np.array(last).astype(float)/usdcny,
-                            "contract" : contract}      
+        rate = USDCNY.rate
+        return {"bitvc" : {'dates':dates,
+                           "bids" : USDCNY.convert(bids, rate),
+                           "asks" : USDCNY.convert(asks, rate),
+                           "last" : USDCNY.convert(last, rate),
+                           "contract" : contract}}
+    return leaves, assemble
+
+FETCHERS = [("bitmex", _fetch_bitmex),
+            ("okcoin", _fetch_okcoin),
+            ("796", _fetch_796),
+            ("bitvc", _fetch_bitvc)]
+
+# name -> (time fetched, entries) of the last good fetch
+_cache = {}
+# name -> _Refresh in flight
+_inflight = {}
+_cache_lock = threading.RLock()
+
+class _Refresh(object):
+
+    """One in-flight fetch of an exchange. Stores the result in the cache
+    when its last request completes, even if get_data stopped waiting."""
+
+    def __init__(self, name, fetch):
+        self.name = name
+        self.done = threading.Event()
+        self.ok = False
+        self.__lock = threading.Lock()
+        leaves, self.__assemble = fetch()
+        self.__remaining = len(leaves)
+        for leaf in leaves:
+            leaf.add_done_callback(self.__leaf_done)
+
+    def __leaf_done(self, leaf):
+        with self.__lock:
+            self.__remaining -= 1
+            if self.__remaining:
+                return
+        try:
+            entries = self.__assemble()
+            with _cache_lock:
+                _cache[self.name] = (time.time(), entries)
+            self.ok = True
+        except Exception:
+            logging.getLogger('root').warning("Unable to fetch %s futures data" % self.name,
+                                              exc_info=True)
+        finally:
+            with _cache_lock:
+                if _inflight.get(self.name) is self:
+                    del _inflight[self.name]
+            self.done.set()
+
+def _refresh(name, fetch):
+    """Start fetching name unless a fetch is already in flight."""
+    with _cache_lock:
+        refresh = _inflight.get(name)
+        if refresh is None:
+            refresh = _Refresh(name, fetch)
+            if not refresh.done.is_set():
+                _inflight[name] = refresh
+    return refresh
+
+def get_data(exchanges=None, ttl=CACHE_TTL, deadline=DEADLINE):
+    """Return spot and futures quotes, answering within about deadline seconds.
+
+    Exchanges fetched less than ttl seconds ago are served from the cache.
+    The others are refetched concurrently; those that have not answered
+    by the deadline are served from their last good values, with
+    'stale': True in their entries and their names in retval['stale'],
+    while the fetch carries on in the background and refreshes the cache.
+    Exchanges that have never answered are left out."""
+    retval = {}
+    futures = {}
+    retval['spot'] = {}
+    retval['stale'] = []
+
+    start = time.time()
+    selected = [("bitfinex", _fetch_bitfinex)] + \
+               [(name, fetch) for name, fetch in FETCHERS
+                if exchanges == None or name in exchanges]
+    # start every request before waiting on any of them
+    refreshes = {}
+    for name, fetch in selected:
+        cached = _cache.get(name)
+        if cached is None or start - cached[0] >= ttl:
+            refreshes[name] = _refresh(name, fetch)
+    for refresh in refreshes.values():
+        refresh.done.wait(max(start + deadline - time.time(), 0))
+
+    for name, fetch in selected:
+        cached = _cache.get(name)
+        if cached is None:
+            continue
+        stale = name in refreshes and not refreshes[name].ok
+        if stale:
+            retval['stale'].append(name)
+        for key, entry in cached[1].items():
+            if name == "bitfinex":
+                retval['spot'][key] = entry
+                continue
+            entry = dict(entry)
+            if stale:
+                entry['stale'] = True
+            futures[key] = entry
     retval['futures'] = futures
     return retval
 
 if __name__ == "__main__":
+    import pprint
     pprint.pprint(get_data())
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+import json
+import logging
+import threading
+import urllib.parse
+import numpy as np
+import websocket
+
+from .bitfutures import get_data, OKCOIN_CONTRACTS
+
+class FuturesCurveEngine(object):
+
+    """Keep the futures structure of bitfutures.get_data current from websockets.
+
+    The curve is seeded from a get_data snapshot, after which BitMEX quote
+    and trade messages and OKCoin future ticker channels write straight
+    into the bid/ask/last cell of the affected expiry.  Subscribers are
+    called as fn(exchange, index, entry) after each change, where entry is
+    the exchange's dict in self.futures.  Expiries roll over only when the
+    engine is reseeded with load()."""
+
+    def __init__(self, data=None):
+        self.logger = logging.getLogger('root')
+        self.spot = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.ws = None
+        self.wst = None
+        self.__cells = {}
+        self.__subscribers = []
+        self.load(data if data is not None else get_data(["bitmex", "okcoin"]))
+
+    def load(self, data):
+        """Replace the curve with a get_data snapshot."""
+        futures = {}
+        cells = {}
+        for exchange, entry in data['futures'].items():
+            entry = dict(entry)
+            for field in ("bids", "asks", "last"):
+                entry[field] = np.array(entry[field], dtype=float)
+            futures[exchange] = entry
+        for i, symbol in enumerate(futures.get("bitmex", {}).get("symbols", [])):
+            cells[("bitmex", symbol)] = i
+        if "okcoin" in futures:
+            for i, contract in enumerate(OKCOIN_CONTRACTS):
+                cells[("okcoin", contract)] = i
+        with self.lock:
+            self.spot = dict(data.get('spot', {}))
+            self.futures = futures
+            self.__cells = cells
+
+    def subscribe(self, fn):
+        self.__subscribers.append(fn)
+
+    def unsubscribe(self, fn):
+        self.__subscribers.remove(fn)
+
+    def update(self, exchange, key, bid=None, ask=None, last=None):
+        """Update one cell. Returns False if the contract is not on the curve."""
+        with self.lock:
+            index = self.__cells.get((exchange, key))
+            if index is None:
+                return False
+            entry = self.futures[exchange]
+            if bid is not None:
+                entry["bids"][index] = bid
+            if ask is not None:
+                entry["asks"][index] = ask
+            if last is not None:
+                entry["last"][index] = last
+        for fn in self.__subscribers:
+            fn(exchange, index, entry)
+        return True
+
+    #
+    # OKCoin
+    #
+    def attach_okcoin(self, okws, symbol="btcusd"):
+        """Subscribe an OKCoinWebsocket to the future ticker of every contract."""
+        for contract in OKCOIN_CONTRACTS:
+            okws.subscribe("ok_%s_future_ticker_%s" % (symbol, contract), self.okcoin_ticker)
+
+    def okcoin_ticker(self, channel, data):
+        if not isinstance(data, dict) or 'buy' not in data:
+            return
+        contract = channel.split("_future_ticker_", 1)[1]
+        self.update("okcoin", contract, float(data['buy']), float(data['sell']),
+                    float(data['last']))
+
+    #
+    # BitMEX
+    #
+    def connect_bitmex(self, endpoint="https://www.bitmex.com/api/v1"):
+        """Open a public BitMEX websocket for the quotes and trades of the curve."""
+        symbols = self.futures.get("bitmex", {}).get("symbols", [])
+        subscriptions = [table + ':' + symbol for symbol in symbols
+                         for table in ("quote", "trade")]
+        urlParts = list(urllib.parse.urlparse(endpoint))
+        urlParts[0] = urlParts[0].replace('http', 'ws')
+        urlParts[2] = "/realtime?subscribe=" + ",".join(subscriptions)
+        self.ws = websocket.WebSocketApp(urllib.parse.urlunparse(urlParts),
+                                         on_message=self.__on_bitmex_message)
+        self.wst = threading.Thread(target=lambda: self.ws.run_forever())
+        self.wst.daemon = True
+        self.wst.start()
+
+    def exit(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    def bitmex_message(self, message):
+        """Apply a decoded BitMEX realtime quote or trade message."""
+        table = message.get('table')
+        if table == 'quote':
+            for row in message['data']:
+                self.update("bitmex", row['symbol'], row.get('bidPrice'), row.get('askPrice'))
+        elif table == 'trade':
+            # only the last trade of each symbol in the message matters
+            last = {}
+            for row in message['data']:
+                last[row['symbol']] = row['price']
+            for symbol, price in last.items():
+                self.update("bitmex", symbol, last=price)
+
+    def __on_bitmex_message(self, ws, message):
+        try:
+            self.bitmex_message(json.loads(message))
+        except Exception:
+            self.logger.exception("Error handling BitMEX curve message")
@@ -7,6 +7,11 @@ import json
 import uuid
 import logging
 import base64
+try:
+    from .metrics import METRICS
+except ImportError:
+    # run as a script, for the demo below
+    from metrics import METRICS
 
 class AuthenticationError(Exception):
     pass
@@ -90,8 +95,10 @@ class BitMEX(object):
     """BitMEX API Connector."""
 
     def __init__(self, base_url=None, login=None, password=None, otpToken=None,
-                 apiKey=None, apiSecret=None, orderIDPrefix='mm_bitmex_'):
-        """Init connector."""
+                 apiKey=None, apiSecret=None, orderIDPrefix='mm_bitmex_', rateLimiter=None):
+        """Init connector.
+
+        rateLimiter, a ratelimit.RateLimiter, is acquired before every request."""
         self.logger = logging.getLogger('root')
         self.base_url = base_url
         self.token = None
@@ -103,6 +110,8 @@ class BitMEX(object):
         if len(orderIDPrefix) > 13:
             raise ValueError("settings.ORDERID_PREFIX must be at most 13 characters long!")
         self.orderIDPrefix = orderIDPrefix
+        self.orderListeners = []
+        self.rateLimiter = rateLimiter
 
         # Prepare HTTPS session
         self.session = requests.Session()
@@ -151,7 +160,26 @@ class BitMEX(object):
             'price': price,
             'clOrdID': clOrdID
         }
-        return self._curl_bitmex(api=endpoint, postdict=postdict, verb="POST")
+        for listener in self.orderListeners:
+            listener.submitted(clOrdID, postdict)
+        response = None
+        try:
+            response = self._curl_bitmex(api=endpoint, postdict=postdict, verb="POST")
+        finally:
+            for listener in self.orderListeners:
+                listener.responded(clOrdID, response)
+        return response
+
+    def add_order_listener(self, listener):
+        """Tell listener about every order place_order sends.
+
+        listener.submitted(clOrdID, postdict) is called just before the
+        request and listener.responded(clOrdID, response) when it returns,
+        with None as the response if it raised."""
+        self.orderListeners.append(listener)
+
+    def remove_order_listener(self, listener):
+        self.orderListeners.remove(listener)
 
     @authentication_required
     def open_orders(self, symbol=None):
@@ -169,6 +197,33 @@ class BitMEX(object):
 #        # Only return orders that start with our clOrdID prefix.
 #        return [o for o in orders if str(o['clOrdID']).startswith(self.orderIDPrefix)]
 
+    #
+    # Public history
+    #
+    def trades(self, symbol, startTime=None, endTime=None, count=500, start=0, reverse=False):
+        """Historical trades of symbol, oldest first unless reverse."""
+        return self._history("trade", symbol, startTime, endTime, count, start, reverse)
+
+    def quotes(self, symbol, startTime=None, endTime=None, count=500, start=0, reverse=False):
+        """Historical best bid and offer changes of symbol."""
+        return self._history("quote", symbol, startTime, endTime, count, start, reverse)
+
+    def trade_bucketed(self, binSize, symbol, startTime=None, endTime=None, count=500, start=0,
+                       reverse=False):
+        """OHLCV buckets of binSize ('1m', '5m', '1h' or '1d')."""
+        return self._history("trade/bucketed", symbol, startTime, endTime, count, start, reverse,
+                             binSize=binSize)
+
+    def _history(self, api, symbol, startTime, endTime, count, start, reverse, **query):
+        """Query a history endpoint. Times are datetimes or ISO strings."""
+        query.update({'symbol': symbol, 'count': count, 'start': start,
+                      'reverse': 'true' if reverse else 'false'})
+        if startTime is not None:
+            query['startTime'] = startTime if isinstance(startTime, str) else startTime.isoformat()
+        if endTime is not None:
+            query['endTime'] = endTime if isinstance(endTime, str) else endTime.isoformat()
+        return self._curl_bitmex(api=api, query=query, verb="GET")
+
     @authentication_required
     def cancel(self, orderID):
         """Cancel an existing order."""
@@ -192,7 +247,13 @@ class BitMEX(object):
         if self.apiKey:
             auth = APIKeyAuthWithExpires(self.apiKey, self.apiSecret)
 
-        # Make the request
+        # Make the request, after any rate limit wait so it is not timed
+        if self.rateLimiter is not None:
+            self.rateLimiter.acquire()
+        endpoint = verb + ' ' + api
+        start = time.perf_counter()
+        def record(error=None, retry=False):
+            METRICS.record('bitmex', endpoint, time.perf_counter() - start, error, retry)
         try:
 #            url = "http://httpbin.org/post"
             req = requests.Request(verb, url, data=postdict, auth=auth, params=query)
@@ -204,6 +265,7 @@ class BitMEX(object):
         except requests.exceptions.HTTPError as e:
             # 401 - Auth error. Re-auth and re-run this request.
             if response.status_code == 401:
+                record('HTTP 401', retry=True)
                 if self.token is None:
                     self.logger.error("Login information or API Key incorrect, please check and restart.")
                     self.logger.error("Error: " + response.text)
@@ -216,40 +278,48 @@ class BitMEX(object):
 
             # 404, can be thrown if order canceled does not exist.
             elif response.status_code == 404:
+                record('HTTP 404')
                 if verb == 'DELETE':
-                    self.logger.error("Order not found: %s" % postdict['orderID'])
+                    self.logger.error("Order not found: %s", postdict['orderID'])
                     return
                 self.logger.error("Unable to contact the BitMEX API (404). " +
-                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                  "Request: %s \n %s", url, postdict)
             # 429, ratelimit
             elif response.status_code == 429:
+                record('HTTP 429', retry=True)
                 self.logger.error("Ratelimited on current request. Sleeping, then trying again. Try fewer " +
                                   "order pairs or contact support@bitmex.com to raise your limits. " +
-                                  "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                  "Request: %s \n %s", url, postdict)
                 sleep(1)
                 return self._curl_bitmex(api, query, postdict, timeout, verb)
 
             # 503 - BitMEX temporary downtime, likely due to a deploy. Try again
             elif response.status_code == 503:
+                record('HTTP 503', retry=True)
                 self.logger.warning("Unable to contact the BitMEX API (503), retrying. " +
-                                    "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                    "Request: %s \n %s", url, postdict)
                 sleep(1)
                 return self._curl_bitmex(api, query, postdict, timeout, verb)
             # Unknown Error
             else:
-                self.logger.error("Unhandled Error: %s: %s %s" % (e, response.text, json.dumps(response.json(), indent=4)))
-                self.logger.error("Endpoint was: %s %s" % (verb, api))
+                record('HTTP %s' % response.status_code)
+                self.logger.error("Unhandled Error: %s: %s", e, response.text)
+                self.logger.error("Endpoint was: %s %s", verb, api)
         except requests.exceptions.Timeout as e:
             # Timeout, re-run this request
+            record('Timeout', retry=True)
             self.logger.warning("Timed out, retrying...")
             return self._curl_bitmex(api, query, postdict, timeout, verb)
 
         except requests.exceptions.ConnectionError as e:
+            record('ConnectionError', retry=True)
             self.logger.warning("Unable to contact the BitMEX API (ConnectionError). Please check the URL. Retrying. " +
-                                "Request: %s \n %s" % (url, json.dumps(postdict)))
+                                "Request: %s \n %s", url, postdict)
             sleep(1)
             return self._curl_bitmex(api, query, postdict, timeout, verb)
 
+        else:
+            record()
         return response.json()
 
 if __name__ == "__main__":
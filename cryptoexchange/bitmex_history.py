@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Resumable bulk download of BitMEX trade, quote and bucketed history.
+
+A time range is cut into fixed chunks which are fetched concurrently,
+each paged through the REST endpoint 500 rows at a time, with every
+request going through the client's RateLimiter.  A finished chunk is
+written as a compressed npz file of one array per column and recorded
+in a checkpoint file, so an interrupted download resumes with the
+chunks still missing.  merge() joins the chunks in time order.
+
+    path/<table>-<symbol>[-<binSize>]/checkpoint.json
+    path/<table>-<symbol>[-<binSize>]/<chunk start>.npz"""
+
+import datetime
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from .bitmex import BitMEX
+from .ratelimit import RateLimiter
+
+# column name -> dtype, filled from the row field of the same name
+COLUMNS = {
+    'trade': [('timestamp', '<M8[ms]'), ('price', '<f8'), ('size', '<f8'), ('side', 'i1')],
+    'quote': [('timestamp', '<M8[ms]'), ('bidSize', '<f8'), ('bidPrice', '<f8'),
+              ('askPrice', '<f8'), ('askSize', '<f8')],
+    'trade/bucketed': [('timestamp', '<M8[ms]'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                       ('close', '<f8'), ('trades', '<f8'), ('volume', '<f8'), ('vwap', '<f8')]
+}
+
+SIDES = {'Buy': 1, 'Sell': -1}
+PAGE = 500
+# BitMEX allows 300 requests per 5 minutes
+RATE = 1.0
+BURST = 10
+# rows of the last seconds may still be published, a chunk ending later is not final
+SETTLE = 60
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def _utc(t):
+    """t as an aware UTC datetime; naive datetimes are taken to be UTC."""
+    if t.tzinfo is None:
+        return t.replace(tzinfo=datetime.timezone.utc)
+    return t.astimezone(datetime.timezone.utc)
+
+def _iso(t):
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+def columns(table, rows):
+    """Convert rows of a history endpoint into {column: array}."""
+    retval = {}
+    for name, dtype in COLUMNS[table]:
+        if name == 'timestamp':
+            # numpy parses ISO timestamps once the 'Z' is dropped
+            values = [row['timestamp'][:23] for row in rows]
+        elif name == 'side':
+            values = [SIDES.get(row.get('side'), 0) for row in rows]
+        else:
+            values = [np.nan if row.get(name) is None else row[name] for row in rows]
+        retval[name] = np.array(values, dtype=dtype)
+    return retval
+
+class HistoryDownloader(object):
+
+    def __init__(self, path, table='trade', symbol='XBTUSD', binSize=None, chunk=3600,
+                 workers=4, bitmex=None, base_url="https://www.bitmex.com/api/v1/"):
+        """Download table ('trade', 'quote' or 'trade/bucketed' with a binSize)
+        in chunks of chunk seconds.  Without a BitMEX client, a public one
+        is created with a RateLimiter of RATE requests per second."""
+        if table not in COLUMNS:
+            raise ValueError("Unknown table %s" % table)
+        if table == 'trade/bucketed' and binSize is None:
+            raise ValueError("trade/bucketed needs a binSize")
+        self.logger = logging.getLogger('root')
+        self.table = table
+        self.symbol = symbol
+        self.binSize = binSize
+        self.chunk = datetime.timedelta(seconds=chunk)
+        self.workers = workers
+        if bitmex is None:
+            bitmex = BitMEX(base_url=base_url, rateLimiter=RateLimiter(RATE, BURST))
+        self.bitmex = bitmex
+        name = '-'.join([table.replace('/', '_'), symbol] + ([binSize] if binSize else []))
+        self.path = os.path.join(path, name)
+        os.makedirs(self.path, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.done = set(self.__load_checkpoint())
+
+    def chunk_start(self, t):
+        """Start of the chunk holding t, as an aware UTC datetime."""
+        return _EPOCH + (_utc(t) - _EPOCH) // self.chunk * self.chunk
+
+    def chunks(self, start, end):
+        """(start, end) pairs covering [start, end), aligned to the chunk size.
+
+        Naive datetimes are taken to be UTC; the bounds returned are aware."""
+        t = self.chunk_start(start)
+        end = _utc(end)
+        retval = []
+        while t < end:
+            retval.append((t, t + self.chunk))
+            t += self.chunk
+        return retval
+
+    def chunk_name(self, start):
+        return start.strftime("%Y%m%dT%H%M%S")
+
+    def __checkpoint_file(self):
+        return os.path.join(self.path, 'checkpoint.json')
+
+    def __load_checkpoint(self):
+        try:
+            with open(self.__checkpoint_file()) as f:
+                return json.load(f)['done']
+        except FileNotFoundError:
+            return []
+
+    def __save_checkpoint(self):
+        tmp = self.__checkpoint_file() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'table': self.table, 'symbol': self.symbol, 'binSize': self.binSize,
+                       'done': sorted(self.done)}, f)
+        os.replace(tmp, self.__checkpoint_file())
+
+    def fetch(self, start, end):
+        """Rows of [start, end) as {column: array}, paging through the endpoint."""
+        rows = []
+        offset = 0
+        while True:
+            if self.table == 'trade/bucketed':
+                page = self.bitmex.trade_bucketed(self.binSize, self.symbol, _iso(start), _iso(end),
+                                                  PAGE, offset)
+            elif self.table == 'quote':
+                page = self.bitmex.quotes(self.symbol, _iso(start), _iso(end), PAGE, offset)
+            else:
+                page = self.bitmex.trades(self.symbol, _iso(start), _iso(end), PAGE, offset)
+            if page is None:
+                raise RuntimeError("No response for %s %s at offset %d" %
+                                   (self.table, _iso(start), offset))
+            rows.extend(page)
+            if len(page) < PAGE:
+                break
+            offset += len(page)
+        data = columns(self.table, rows)
+        # endTime is inclusive, keep a row on a chunk boundary in one chunk only
+        keep = data['timestamp'] < np.datetime64(_utc(end).replace(tzinfo=None), 'ms')
+        return {name: column[keep] for name, column in data.items()}
+
+    def __fetch_chunk(self, start, end):
+        data = self.fetch(start, end)
+        name = self.chunk_name(start)
+        tmp = os.path.join(self.path, name + '.tmp.npz')
+        np.savez_compressed(tmp, **data)
+        os.replace(tmp, os.path.join(self.path, name + '.npz'))
+        if end <= datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=SETTLE):
+            with self.__lock:
+                self.done.add(name)
+                self.__save_checkpoint()
+        return len(data['timestamp'])
+
+    def download(self, start, end):
+        """Fetch the chunks of [start, end) not downloaded yet.
+
+        Returns {'chunks', 'skipped', 'rows', 'failed'}; failed chunks, and
+        chunks ending less than SETTLE seconds ago, are fetched again by the
+        next call."""
+        chunks = self.chunks(start, end)
+        todo = [c for c in chunks if self.chunk_name(c[0]) not in self.done]
+        rows = 0
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.__fetch_chunk, s, e): s for s, e in todo}
+            for future in as_completed(futures):
+                try:
+                    rows += future.result()
+                except Exception:
+                    self.logger.exception("Chunk %s failed", self.chunk_name(futures[future]))
+                    failed.append(self.chunk_name(futures[future]))
+        return {'chunks': len(chunks), 'skipped': len(chunks) - len(todo),
+                'rows': rows, 'failed': sorted(failed)}
+
+    def unsettled(self):
+        """Names of the chunks downloaded but not yet settled (see SETTLE)."""
+        with self.__lock:
+            done = set(self.done)
+        return sorted(f[:-4] for f in os.listdir(self.path)
+                      if f.endswith('.npz') and not f.endswith('.tmp.npz') and f[:-4] not in done)
+
+    def merge(self, start=None, end=None, out=None, provisional=False):
+        """Concatenate the downloaded chunks (of [start, end) if given) in time order.
+
+        Only settled chunks are merged unless provisional is True; the rows
+        of unsettled chunks may still be incomplete.  Unsettled chunks that
+        are left out are logged.  Returns {column: array} and, if out is a
+        filename, also saves it there."""
+        names = sorted(self.done)
+        unsettled = self.unsettled()
+        if start is not None:
+            first = self.chunk_name(self.chunk_start(start))
+            names = [n for n in names if n >= first]
+            unsettled = [n for n in unsettled if n >= first]
+        if end is not None:
+            last = self.chunk_name(_utc(end))
+            names = [n for n in names if n < last]
+            unsettled = [n for n in unsettled if n < last]
+        if provisional:
+            names = sorted(names + unsettled)
+        elif unsettled:
+            self.logger.warning("Merge leaves out unsettled chunks %s", ', '.join(unsettled))
+        parts = {name: [] for name, dtype in COLUMNS[self.table]}
+        for name in names:
+            with np.load(os.path.join(self.path, name + '.npz')) as chunk:
+                for column in parts:
+                    parts[column].append(chunk[column])
+        data = {column: np.concatenate(arrays) if arrays else np.zeros(0, dtype)
+                for (column, arrays), (n, dtype) in zip(parts.items(), COLUMNS[self.table])}
+        if out is not None:
+            np.savez_compressed(out, **data)
+        return data
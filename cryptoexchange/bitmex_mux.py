@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Many BitMEX accounts and one public feed over a single websocket.
+
+The /realtimemd endpoint multiplexes independent streams over one
+connection.  Every frame is a json array [type, id, topic, payload]:
+
+    [1, id, topic]           open a stream
+    [2, id, topic]           close it
+    [0, id, topic, payload]  a message on it, in either direction
+
+Each account gets a stream of its own, authenticated with
+authKeyExpires, that subscribes to the account tables only.  Market
+data is subscribed once, on a shared 'public' stream, however many
+accounts there are.  The tables of each stream are kept apart in a
+MultiplexStream, which has the data, keys, lock and listener interface
+of BitMEXWebsocket, so OrderManager, OrderLatencyTracer,
+MarketDataPublisher and the other helpers attach to a stream as they
+would to a BitMEXWebsocket."""
+
+import json
+import logging
+import threading
+import time
+import urllib.parse
+import websocket
+
+from .bitmex_ws import apply_table_message, generate_signature
+
+MESSAGE = 0
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+
+PUBLIC = 'public'
+PUBLIC_TABLES = ('instrument', 'quote', 'trade', 'orderBook25')
+ACCOUNT_TABLES = ('order', 'execution', 'position', 'margin')
+
+class MultiplexStream(object):
+
+    """Tables of one stream of a BitMEXMultiplexWebsocket."""
+
+    def __init__(self, name, subscriptions, apiKey=None, apiSecret=None):
+        self.logger = logging.getLogger('root')
+        self.name = name
+        self.subscriptions = list(subscriptions)
+        self.apiKey = apiKey
+        self.apiSecret = apiSecret
+        self.data = {}
+        self.keys = {}
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.subscribed = set()
+        self.error = None
+
+    def add_listener(self, listener):
+        '''Call listener(table, action, rows) after every table message.'''
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def open_messages(self):
+        '''Payloads to send on the stream once it is opened.'''
+        messages = []
+        if self.apiKey:
+            expires = int(round(time.time()) + 5)
+            signature = generate_signature(self.apiSecret, 'GET', '/realtime', expires, '')
+            messages.append({"op": "authKeyExpires", "args": [self.apiKey, expires, signature]})
+        messages.append({"op": "subscribe", "args": self.subscriptions})
+        return messages
+
+    def handle(self, message):
+        '''Apply a message received on the stream.'''
+        if 'subscribe' in message:
+            if message.get('success'):
+                self.subscribed.add(message['subscribe'])
+            else:
+                self.logger.error("%s: subscribing to %s failed", self.name, message['subscribe'])
+        elif 'error' in message:
+            self.error = message['error']
+            self.logger.error("%s: %s", self.name, message['error'])
+        elif message.get('action'):
+            table = message['table']
+            with self.lock:
+                apply_table_message(self.data, self.keys, message)
+                for listener in self.listeners:
+                    listener(table, message['action'], message['data'])
+
+    def wait(self, tables, timeout=10):
+        '''Wait until every table has arrived. Returns False on timeout or error.'''
+        end = time.time() + timeout
+        while not set(tables) <= set(self.data):
+            if self.error is not None or time.time() > end:
+                return False
+            time.sleep(0.1)
+        return True
+
+class BitMEXMultiplexWebsocket(object):
+
+    """One connection to /realtimemd carrying a public stream and account streams."""
+
+    def __init__(self, endpoint="https://www.bitmex.com/api/v1", symbols=("XBTUSD",),
+                 public_tables=PUBLIC_TABLES):
+        self.logger = logging.getLogger('root')
+        self.endpoint = endpoint
+        self.ws = None
+        self.wst = None
+        self.exited = False
+        self.streams = {}
+        self.__lock = threading.Lock()
+        self.public = self.__add(MultiplexStream(
+            PUBLIC, [table + ':' + symbol for symbol in symbols for table in public_tables]))
+
+    def url(self):
+        urlParts = list(urllib.parse.urlparse(self.endpoint))
+        urlParts[0] = urlParts[0].replace('http', 'ws')
+        urlParts[2] = "/realtimemd"
+        return urllib.parse.urlunparse(urlParts)
+
+    def add_account(self, name, apiKey, apiSecret, tables=ACCOUNT_TABLES, symbol=None):
+        """Open an authenticated stream for an account and return it.
+
+        tables are subscribed unfiltered, or for symbol only if given."""
+        if name == PUBLIC or name in self.streams:
+            raise ValueError("Stream %s already exists" % name)
+        subscriptions = [table if symbol is None or table == 'margin' else table + ':' + symbol
+                         for table in tables]
+        return self.__add(MultiplexStream(name, subscriptions, apiKey, apiSecret))
+
+    def remove_account(self, name):
+        with self.__lock:
+            self.streams.pop(name)
+            if self.connected():
+                self.__send([UNSUBSCRIBE, name, name])
+
+    def account(self, name):
+        return self.streams[name]
+
+    def __add(self, stream):
+        with self.__lock:
+            self.streams[stream.name] = stream
+            if self.connected():
+                self.__open(stream)
+        return stream
+
+    def __open(self, stream):
+        self.__send([SUBSCRIBE, stream.name, stream.name])
+        for payload in stream.open_messages():
+            self.__send([MESSAGE, stream.name, stream.name, payload])
+
+    def __send(self, frame):
+        self.ws.send(json.dumps(frame))
+
+    def connected(self):
+        return self.ws is not None and self.ws.sock is not None and self.ws.sock.connected
+
+    def connect(self, timeout=5):
+        '''Connect to the websocket in a thread. Streams are (re)opened on connect.'''
+        self.exited = False
+        self.ws = websocket.WebSocketApp(self.url(),
+                                         on_message=self.__on_message,
+                                         on_error=self.__on_error,
+                                         on_close=self.__on_close,
+                                         on_open=self.__on_open)
+        self.wst = threading.Thread(target=lambda: self.ws.run_forever())
+        self.wst.daemon = True
+        self.wst.start()
+        while not self.connected() and timeout > 0:
+            time.sleep(0.1)
+            timeout -= 0.1
+        if not self.connected():
+            self.logger.error("Couldn't connect to BitMEX multiplexed websocket.")
+            self.exit()
+            return False
+        return True
+
+    def exit(self):
+        self.exited = True
+        if self.ws is not None:
+            self.ws.close()
+
+    def dispatch(self, frame):
+        '''Route a raw frame to its stream.'''
+        message = json.loads(frame)
+        if not isinstance(message, list) or len(message) < 4 or message[0] != MESSAGE:
+            self.logger.debug("Multiplex control frame %s", frame)
+            return
+        stream = self.streams.get(message[1])
+        if stream is not None:
+            stream.handle(message[3])
+
+    def __on_message(self, ws, frame):
+        try:
+            self.dispatch(frame)
+        except Exception:
+            self.logger.exception("Error handling BitMEX multiplexed message")
+
+    def __on_open(self, ws):
+        self.logger.debug("BitMEX multiplexed websocket opened.")
+        with self.__lock:
+            for stream in list(self.streams.values()):
+                self.__open(stream)
+
+    def __on_error(self, ws, error):
+        if not self.exited:
+            self.logger.error("BitMEX multiplexed websocket error : %s", error)
+
+    def __on_close(self, ws, *args):
+        self.logger.info('BitMEX multiplexed websocket closed')
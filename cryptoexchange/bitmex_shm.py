@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Share one BitMEX websocket between processes through shared memory.
+
+A MarketDataPublisher listens to a BitMEXWebsocket and writes the best
+bid and offer, the recent trades and the positions of a symbol into a
+named shared memory block.  Any number of MarketDataReaders on the same
+host attach to the block read-only and see the updates without a
+socket or a copy of the tables of their own.
+
+The block is a fixed layout of numpy structured arrays:
+
+    header     magic, version, state, capacities, symbol
+    bbo        one row, guarded by a seqlock
+    positions  position_capacity rows and a count, guarded by a seqlock
+    trades     ring of trade_capacity rows, each with its own sequence
+
+Seqlocks: the writer makes the sequence odd, writes, and makes it even
+again.  A reader copies the row and keeps the copy only if the sequence
+was even and unchanged across the copy, otherwise it retries.  A trade
+slot holds 2n+2 once trade number n is completely written to it, so a
+reader can tell a finished trade from one being overwritten.
+
+Every row carries the time it was published, and readers record the
+delay until they saw it in LatencyStats."""
+
+import logging
+import threading
+import time
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from .instruments import parse_timestamp
+from .latency import LatencyStats
+
+MAGIC = b'BMXSHM'
+VERSION = 1
+OPEN = 1
+CLOSED = 2
+
+HEADER_DTYPE = np.dtype([('magic', 'S8'),
+                         ('version', '<u4'),
+                         ('state', '<u4'),
+                         ('trade_capacity', '<u4'),
+                         ('position_capacity', '<u4'),
+                         ('symbol', 'S16')])
+
+BBO_DTYPE = np.dtype([('seq', '<u8'),
+                      ('timestamp', '<f8'),
+                      ('published', '<f8'),
+                      ('bidPrice', '<f8'),
+                      ('bidSize', '<f8'),
+                      ('askPrice', '<f8'),
+                      ('askSize', '<f8')])
+
+TRADE_DTYPE = np.dtype([('seq', '<u8'),
+                        ('timestamp', '<f8'),
+                        ('published', '<f8'),
+                        ('price', '<f8'),
+                        ('size', '<f8'),
+                        # 1 for Buy, -1 for Sell
+                        ('side', '<i8')])
+
+POSITION_DTYPE = np.dtype([('symbol', 'S16'),
+                           ('currentQty', '<f8'),
+                           ('avgEntryPrice', '<f8'),
+                           ('markPrice', '<f8'),
+                           ('liquidationPrice', '<f8'),
+                           ('unrealisedPnl', '<f8'),
+                           ('realisedPnl', '<f8')])
+
+# sequence (or count) and publish time in front of positions and trades
+CONTROL_DTYPE = np.dtype([('seq', '<u8'),
+                          ('count', '<u8'),
+                          ('published', '<f8')])
+
+SIDES = {'Buy': 1, 'Sell': -1}
+
+def default_name(symbol):
+    return 'bitmex-' + symbol
+
+def _layout(buf, trade_capacity, position_capacity):
+    """Views of the regions of buf, and the size the layout needs."""
+    regions = [('header', HEADER_DTYPE, 1),
+               ('bbo', BBO_DTYPE, 1),
+               ('position_control', CONTROL_DTYPE, 1),
+               ('positions', POSITION_DTYPE, position_capacity),
+               ('trade_control', CONTROL_DTYPE, 1),
+               ('trades', TRADE_DTYPE, trade_capacity)]
+    views = {}
+    offset = 0
+    for name, dtype, n in regions:
+        if buf is not None:
+            views[name] = np.ndarray((n,), dtype=dtype, buffer=buf, offset=offset)
+        offset += dtype.itemsize * n
+    return views, offset
+
+_attach_lock = threading.Lock()
+
+class _Untracked(object):
+    # stands in for resource_tracker inside shared_memory while attaching
+    @staticmethod
+    def register(name, rtype):
+        pass
+
+def _attach(name):
+    """Open an existing block without handing it to the resource tracker.
+
+    The tracker unlinks registered blocks when the process exits, which
+    must not happen to a block a reader merely attached to.  Before
+    Python 3.13 there is no track=False, so shared_memory's reference to
+    the tracker is swapped out for the duration of the call only."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    with _attach_lock:
+        shared_memory.resource_tracker = _Untracked
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            shared_memory.resource_tracker = resource_tracker
+
+def _float(value):
+    return np.nan if value is None else float(value)
+
+class MarketDataPublisher(object):
+
+    """Write the market data of one symbol into a new shared memory block."""
+
+    def __init__(self, symbol, name=None, trade_capacity=1024, position_capacity=16):
+        self.logger = logging.getLogger('root')
+        self.symbol = symbol
+        self.name = name or default_name(symbol)
+        size = _layout(None, trade_capacity, position_capacity)[1]
+        self.shm = shared_memory.SharedMemory(self.name, create=True, size=size)
+        self.__views = _layout(self.shm.buf, trade_capacity, position_capacity)[0]
+        header = self.__views['header']
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['trade_capacity'] = trade_capacity
+        header['position_capacity'] = position_capacity
+        header['symbol'] = symbol.encode('ascii')
+        self.__views['bbo'][:] = (0, np.nan, np.nan, np.nan, np.nan, np.nan, np.nan)
+        header['state'] = OPEN
+        self.ws = None
+
+    def attach(self, ws):
+        """Publish the current state of ws and follow its updates."""
+        self.ws = ws
+        if ws.data.get('quote'):
+            self.publish_quote(ws.data['quote'][-1])
+        for row in ws.data.get('trade', [])[-len(self.__views['trades']):]:
+            self.publish_trade(row)
+        self.publish_positions(ws.data.get('position', []))
+        ws.add_listener(self.on_table)
+        return self
+
+    def detach(self):
+        if self.ws is not None:
+            self.ws.remove_listener(self.on_table)
+            self.ws = None
+
+    def on_table(self, table, action, rows):
+        """BitMEXWebsocket listener."""
+        if action == 'delete' and table != 'position':
+            return
+        if table == 'quote':
+            rows = [row for row in rows if row.get('symbol') == self.symbol]
+            if rows:
+                self.publish_quote(rows[-1])
+        elif table == 'trade':
+            for row in rows:
+                if row.get('symbol') == self.symbol:
+                    self.publish_trade(row)
+        elif table == 'position':
+            # rows are deltas, the websocket holds the merged rows
+            self.publish_positions(self.ws.data['position'] if self.ws else rows)
+
+    def publish_quote(self, row):
+        bbo = self.__views['bbo']
+        seq = int(bbo['seq'][0])
+        bbo['seq'] = seq + 1
+        bbo['timestamp'] = parse_timestamp(row['timestamp']) if row.get('timestamp') else np.nan
+        bbo['bidPrice'] = _float(row.get('bidPrice'))
+        bbo['bidSize'] = _float(row.get('bidSize'))
+        bbo['askPrice'] = _float(row.get('askPrice'))
+        bbo['askSize'] = _float(row.get('askSize'))
+        bbo['published'] = time.time()
+        bbo['seq'] = seq + 2
+
+    def publish_trade(self, row):
+        control = self.__views['trade_control']
+        trades = self.__views['trades']
+        n = int(control['count'][0])
+        slot = trades[n % len(trades):n % len(trades) + 1]
+        slot['seq'] = 2 * n + 1
+        slot['timestamp'] = parse_timestamp(row['timestamp']) if row.get('timestamp') else np.nan
+        slot['price'] = _float(row.get('price'))
+        slot['size'] = _float(row.get('size'))
+        slot['side'] = SIDES.get(row.get('side'), 0)
+        slot['published'] = time.time()
+        slot['seq'] = 2 * n + 2
+        control['count'] = n + 1
+        control['published'] = slot['published'][0]
+
+    def publish_positions(self, rows):
+        control = self.__views['position_control']
+        positions = self.__views['positions']
+        if len(rows) > len(positions):
+            self.logger.warning("%d positions, only %d are published", len(rows), len(positions))
+            rows = rows[:len(positions)]
+        seq = int(control['seq'][0])
+        control['seq'] = seq + 1
+        for i, row in enumerate(rows):
+            positions[i] = (str(row.get('symbol', '')).encode('ascii'),
+                            _float(row.get('currentQty')),
+                            _float(row.get('avgEntryPrice')),
+                            _float(row.get('markPrice')),
+                            _float(row.get('liquidationPrice')),
+                            _float(row.get('unrealisedPnl')),
+                            _float(row.get('realisedPnl')))
+        control['count'] = len(rows)
+        control['published'] = time.time()
+        control['seq'] = seq + 2
+
+    def close(self):
+        """Mark the block closed for readers and remove it."""
+        self.detach()
+        self.__views['header']['state'] = CLOSED
+        self.__views = None
+        self.shm.close()
+        self.shm.unlink()
+
+class MarketDataReader(object):
+
+    """Attach read-only to the block of a MarketDataPublisher.
+
+    bbo_view, positions_view and trades_view are read-only numpy views of
+    the shared memory itself; bbo(), positions() and trades() return
+    consistent copies.  Drop any views before calling close()."""
+
+    def __init__(self, symbol=None, name=None, retries=1000):
+        if name is None:
+            name = default_name(symbol)
+        self.name = name
+        self.retries = retries
+        self.shm = _attach(name)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=self.shm.buf)
+        if header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+            raise ValueError("%s is not a market data block of version %d" % (name, VERSION))
+        self.symbol = header['symbol'][0].decode('ascii')
+        views = _layout(self.shm.buf, int(header['trade_capacity'][0]),
+                        int(header['position_capacity'][0]))[0]
+        for view in views.values():
+            view.flags.writeable = False
+        self.__views = views
+        self.header_view = views['header']
+        self.bbo_view = views['bbo']
+        self.positions_view = views['positions']
+        self.trades_view = views['trades']
+        self.__bbo_seq = 0
+        self.__positions_seq = 0
+        self.__trade_count = 0
+        self.latency = {'bbo': LatencyStats(), 'trade': LatencyStats(), 'position': LatencyStats()}
+
+    @property
+    def closed(self):
+        return self.__views is None or self.header_view['state'][0] == CLOSED
+
+    def __read(self, seq, read):
+        for i in range(self.retries):
+            before = int(seq[0])
+            if not before & 1:
+                value = read()
+                if int(seq[0]) == before:
+                    return before, value
+            # let a preempted writer finish
+            time.sleep(0)
+        raise RuntimeError("%s: no consistent read in %d tries" % (self.name, self.retries))
+
+    def bbo(self):
+        """Copy of the current best bid and offer record."""
+        bbo = self.bbo_view
+        return self.__read(bbo['seq'], bbo.copy)[1][0]
+
+    def positions(self):
+        control = self.__views['position_control']
+        positions = self.positions_view
+        return self.__read(control['seq'],
+                           lambda: positions[:int(control['count'][0])].copy())[1]
+
+    def trades(self, n=None, since=0):
+        """Copies of the last n trades (all the ring holds by default) numbered from since on.
+
+        Returns the trades in order and the number to pass as since to
+        get only newer ones.  Trades overwritten while being copied are
+        left out."""
+        trades = self.trades_view
+        capacity = len(trades)
+        count = int(self.__views['trade_control']['count'][0])
+        first = max(count - min(n or capacity, capacity), since)
+        if first >= count:
+            return np.zeros(0, dtype=TRADE_DTYPE), count
+        numbers = np.arange(first, count, dtype=np.uint64)
+        rows = trades[numbers % capacity].copy()
+        ok = rows['seq'] == 2 * numbers + 2
+        # and a slot rewritten during the copy has moved on since
+        ok &= trades['seq'][numbers % capacity] == rows['seq']
+        return rows[ok], count
+
+    def poll(self):
+        """New best bid and offer since the last poll, or None."""
+        bbo = self.bbo_view
+        if int(bbo['seq'][0]) == self.__bbo_seq:
+            return None
+        seq, rows = self.__read(bbo['seq'], bbo.copy)
+        if seq == self.__bbo_seq:
+            return None
+        self.__bbo_seq = seq
+        self.latency['bbo'].add(time.time() - rows['published'][0])
+        return rows[0]
+
+    def poll_trades(self):
+        """Trades published since the last call."""
+        rows, self.__trade_count = self.trades(since=self.__trade_count)
+        if len(rows):
+            now = time.time()
+            for published in rows['published']:
+                self.latency['trade'].add(now - published)
+        return rows
+
+    def poll_positions(self):
+        """Positions if they changed since the last call, else None."""
+        control = self.__views['position_control']
+        if int(control['seq'][0]) == self.__positions_seq:
+            return None
+        positions = self.positions_view
+        seq, rows = self.__read(control['seq'],
+                                lambda: (positions[:int(control['count'][0])].copy(),
+                                         float(control['published'][0])))
+        self.__positions_seq = seq
+        self.latency['position'].add(time.time() - rows[1])
+        return rows[0]
+
+    def stats(self):
+        return {name: stats.summary() for name, stats in self.latency.items()}
+
+    def close(self):
+        self.__views = None
+        self.header_view = self.bbo_view = self.positions_view = self.trades_view = None
+        self.shm.close()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 import sys
+import os
+import gzip
+import queue
 import websocket
 import threading
-import traceback
 from time import sleep
 import json
 import string
@@ -13,6 +15,17 @@ import time
 import hmac
 import hashlib
 
+try:
+    from .conflation import Conflator
+    from .latency import LatencyStats
+except ImportError:
+    # run as a script, for the demo below
+    from conflation import Conflator
+    from latency import LatencyStats
+
+# version of the table snapshot files, see BitMEXWebsocket.save_snapshot
+SNAPSHOT_VERSION = 1
+
 def generate_nonce():
     return int(round(time.time() * 1000))
 
@@ -55,8 +68,32 @@ def generate_signature(secret, verb, url, nonce, data):
 # poll really often if it wants.
 class BitMEXWebsocket():
 
-    def __init__(self, endpoint="", symbol="XBU24H", API_KEY=None, API_SECRET=None, LOGIN=None, PASSWORD=None):
-        '''Connect to the websocket and initialize data stores.'''
+    def __init__(self, endpoint="", symbol="XBU24H", API_KEY=None, API_SECRET=None, LOGIN=None, PASSWORD=None,
+                 listeners=None, pipeline=False, queue_size=10000, batch_size=100, conflate=False,
+                 snapshot_path=None, snapshot_interval=30.0):
+        '''Connect to the websocket and initialize data stores.
+
+        listeners are called as listener(table, action, rows) after each
+        table message is applied, starting with the initial partials.
+
+        With pipeline=True the websocket thread only queues raw frames and
+        a separate thread parses and applies them in batches of up to
+        batch_size, merging consecutive messages that insert, update or
+        delete rows of the same table.  If more than queue_size frames are
+        waiting, the backlog is discarded and the tables are fetched again
+        with getAccount and getSymbol.
+
+        conflate=True (or a list of tables, True meaning ['quote']) keeps
+        only the latest row per symbol of those tables, both in self.data
+        and in self.conflated, a Conflator keyed by (table, symbol) from
+        which a consumer drains the rows that changed since its last read.
+
+        With a snapshot_path the tables, and any state registered with
+        register_state(), are written there every snapshot_interval
+        seconds and on exit(), and read back on start-up.  The constructor
+        then returns without waiting for the account and symbol pushes;
+        the restored tables are listed in self.stale until live partials
+        replace them.'''
         self.logger = logging.getLogger('root')
         self.logger.debug("Initializing WebSocket.")
         self.endpoint = endpoint
@@ -64,13 +101,36 @@ class BitMEXWebsocket():
         self.api_secret = API_SECRET
         self.login = LOGIN
         self.password = PASSWORD
+        self.symbol = symbol
+        self.exited = False
         self.data = {}
         self.keys = {}
+        self.listeners = list(listeners or [])
+        # held while a message is applied, so snapshots see whole messages
+        self.lock = threading.RLock()
+        self.stale = set()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.__state = {}
+        self.__restored = {}
+        self.__snapshotLock = threading.Lock()
+        if snapshot_path:
+            self.__load_snapshot()
+        self.batch_size = batch_size
+        self.merged = 0
+        self.conflated = None
+        self.conflateTables = ()
+        if conflate:
+            self.conflated = Conflator()
+            self.conflateTables = frozenset(['quote'] if conflate is True else conflate)
+        self.__queue = None
+        if pipeline:
+            self.__start_pipeline(queue_size)
 
         # We can subscribe right in the connection querystring, so let's build that.
         # Subscribe to all pertinent endpoints
         wsURL = self.__get_url(symbol)
-        self.logger.info("Connecting to %s" % wsURL)
+        self.logger.info("Connecting to %s", wsURL)
         self.__connect(wsURL, symbol)
         self.logger.info('Connected to WS.')
 
@@ -79,9 +139,28 @@ class BitMEXWebsocket():
         self.__push_symbol(symbol)
         self.logger.info('Got all market data. Starting.')
 
+        if snapshot_path:
+            self.snapshotThread = threading.Thread(target=self.__run_snapshots, name="bitmex-snapshot")
+            self.snapshotThread.daemon = True
+            self.snapshotThread.start()
+
     def exit(self):
         self.exited = True
         self.ws.close()
+        if self.__queue is not None:
+            self.__queue.put(None)
+        if self.snapshot_path:
+            self.save_snapshot()
+
+    def add_listener(self, listener):
+        '''Call listener(table, action, rows) after every table message.
+
+        Tables already received are not replayed; pass listeners to the
+        constructor to see the initial partials.'''
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
 
     def get_instrument(self):
         # Turn the 'tickSize' into 'tickLog' for use in rounding
@@ -195,58 +274,235 @@ class BitMEXWebsocket():
 
     def __on_message(self, ws, message):
         '''Handler for parsing WS messages.'''
-        message = json.loads(message)
-        self.logger.debug(json.dumps(message))
-
-        table = message['table'] if 'table' in message else None
-        action = message['action'] if 'action' in message else None
+        if self.__queue is None:
+            self.__apply([message])
+            return
+        # Pipeline mode: nothing but a non-blocking put on this thread
+        self.received += 1
         try:
+            self.__queue.put_nowait((time.time(), message))
+        except queue.Full:
+            self.overflowed = True
+            self.dropped += 1
+
+    def __apply(self, frames):
+        '''Parse frames and apply them, merging consecutive row changes of a table.'''
+        messages = []
+        for frame in frames:
+            # Log the raw frame: it is already a string and cannot change later
+            self.logger.debug(frame)
+            try:
+                message = json.loads(frame)
+            except ValueError:
+                self.logger.exception("Invalid frame")
+                continue
             if 'subscribe' in message:
-                self.logger.debug("Subscribed to %s." % message['subscribe'])
-            elif action:
-
-                if table not in self.data:
-                    self.data[table] = []
-
-                # There are four possible actions from the WS:
-                # 'partial' - full table image
-                # 'insert'  - new row
-                # 'update'  - update row
-                # 'delete'  - delete row
-                if action == 'partial':
-                    self.logger.debug("%s: partial" % table)
-                    self.data[table] += message['data']
-                    # Keys are communicated on partials to let you know how to uniquely identify
-                    # an item. We use it for updates.
-                    self.keys[table] = message['keys']
-                elif action == 'insert':
-                    self.logger.debug('%s: inserting %s' % (table, message['data']))
-                    self.data[table] += message['data']
-                elif action == 'update':
-                    self.logger.debug('%s: updating %s' % (table, message['data']))
-                    # Locate the item in the collection and update it.
-                    for updateData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], updateData)
-                        if not item:
-                            return  # No item found to update. Could happen before push
-                        item.update(updateData)
-                        # Remove cancelled / filled orders
-                        if table == 'order' and item['leavesQty'] <= 0:
-                            self.data[table].remove(item)
-                elif action == 'delete':
-                    self.logger.debug('%s: deleting %s' % (table, message['data']))
-                    # Locate the item in the collection and remove it.
-                    for deleteData in message['data']:
-                        item = findItemByKeys(self.keys[table], self.data[table], deleteData)
-                        self.data[table].remove(item)
+                self.logger.debug("Subscribed to %s.", message['subscribe'])
+            elif message.get('action'):
+                last = messages[-1] if messages else None
+                if last is not None and last['action'] == message['action'] != 'partial' and \
+                   last['table'] == message['table']:
+                    last['data'].extend(message['data'])
+                    self.merged += 1
                 else:
-                    raise Exception("Unknown action: %s" % action)
-        except:
-            self.logger.error(traceback.format_exc())
+                    messages.append(message)
+
+        for message in messages:
+            table = message['table']
+            action = message['action']
+            try:
+                self.logger.debug('%s: %s %d rows', table, action, len(message['data']))
+                with self.lock:
+                    if table in self.conflateTables:
+                        self.__conflate(message)
+                    apply_table_message(self.data, self.keys, message)
+                    if action == 'partial':
+                        self.stale.discard(table)
+                    if table in self.conflateTables:
+                        self.__publish_conflated(message)
+                    for listener in self.listeners:
+                        listener(table, action, message['data'])
+            except:
+                # The traceback is formatted by the log handler, not here
+                self.logger.exception("Error handling %s message", table)
+
+    #
+    # Snapshots
+    #
+    def register_state(self, name, save, restore):
+        '''Include derived state in snapshots.
+
+        save() returns a json serialisable value, called with self.lock
+        held so that it is consistent with the tables.  restore(value) is
+        called with the value of the last snapshot, right away if one was
+        loaded at start-up.'''
+        self.__state[name] = (save, restore)
+        if name in self.__restored:
+            restore(self.__restored.pop(name))
+
+    def save_snapshot(self):
+        '''Write the tables and registered state to snapshot_path.'''
+        with self.lock:
+            snapshot = {'version': SNAPSHOT_VERSION,
+                        'time': time.time(),
+                        'endpoint': self.endpoint,
+                        'symbol': self.symbol,
+                        'keys': dict(self.keys),
+                        'data': {table: [dict(row) for row in rows] for table, rows in self.data.items()},
+                        'state': {name: save() for name, (save, restore) in self.__state.items()}}
+        # serialise and compress outside the lock, then swap the file in
+        # atomically so a crash never leaves a torn snapshot
+        tmp = self.snapshot_path + '.tmp'
+        with self.__snapshotLock:
+            with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=1) as f:
+                json.dump(snapshot, f, separators=(',', ':'))
+            os.replace(tmp, self.snapshot_path)
+
+    def __load_snapshot(self):
+        try:
+            with gzip.open(self.snapshot_path, 'rt', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            self.logger.exception("Ignoring unreadable snapshot %s", self.snapshot_path)
+            return
+        if snapshot.get('version') != SNAPSHOT_VERSION or \
+           (snapshot.get('endpoint'), snapshot.get('symbol')) != (self.endpoint, self.symbol):
+            self.logger.warning("Ignoring snapshot %s of another version, endpoint or symbol",
+                                self.snapshot_path)
+            return
+        self.data = snapshot['data']
+        self.keys = snapshot['keys']
+        self.stale = set(self.data)
+        self.__restored = snapshot['state']
+        self.logger.info("Restored %s from %.0f seconds ago", ", ".join(sorted(self.data)),
+                         time.time() - snapshot['time'])
+
+    def __run_snapshots(self):
+        while not self.exited:
+            sleep(self.snapshot_interval)
+            if self.exited:
+                break
+            try:
+                self.save_snapshot()
+            except Exception:
+                self.logger.exception("Error writing snapshot %s", self.snapshot_path)
+
+    #
+    # Conflation
+    #
+    def __conflate(self, message):
+        '''Reduce a partial or insert to the last row of each symbol.
+
+        The rows of an insert then replace the stored rows of their symbols.'''
+        if message['action'] not in ('partial', 'insert'):
+            return
+        latest = {}
+        for row in message['data']:
+            latest[row['symbol']] = row
+        self.conflated.skip(len(message['data']) - len(latest))
+        message['data'] = list(latest.values())
+        if message['action'] == 'insert':
+            self.data[message['table']] = [row for row in self.data.get(message['table'], [])
+                                           if row['symbol'] not in latest]
+
+    def __publish_conflated(self, message):
+        table = message['table']
+        if message['action'] == 'delete':
+            return
+        for row in message['data']:
+            if message['action'] == 'update':
+                # updates carry changed fields only, publish the whole row
+                row = findItemByKeys(self.keys[table], self.data[table], row)
+                if not row:
+                    continue
+            self.conflated.put((table, row['symbol']), dict(row))
+
+    #
+    # Pipeline mode
+    #
+    def __start_pipeline(self, queue_size):
+        self.__queue = queue.Queue(queue_size)
+        self.received = 0
+        self.applied = 0
+        self.batches = 0
+        self.overflowed = False
+        self.overflows = 0
+        self.dropped = 0
+        self.max_depth = 0
+        # time frames spent waiting in the queue
+        self.queue_latency = LatencyStats()
+        self.applyThread = threading.Thread(target=self.__run_pipeline, name="bitmex-apply")
+        self.applyThread.daemon = True
+        self.applyThread.start()
+
+    def __run_pipeline(self):
+        q = self.__queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            depth = q.qsize() + len(batch)
+            if depth > self.max_depth:
+                self.max_depth = depth
+            stop = None in batch
+            if stop:
+                batch = batch[:batch.index(None)]
+            now = time.time()
+            for received, frame in batch:
+                self.queue_latency.add(now - received)
+            self.__apply([frame for received, frame in batch])
+            self.applied += len(batch)
+            self.batches += 1
+            if stop:
+                return
+            if self.overflowed:
+                self.__resync()
+
+    def __resync(self):
+        '''Throw away the backlog and ask for fresh partials of every table.'''
+        self.overflowed = False
+        self.overflows += 1
+        discarded = 0
+        while True:
+            try:
+                if self.__queue.get_nowait() is None:
+                    self.__queue.put(None)
+                    return
+            except queue.Empty:
+                break
+            discarded += 1
+        self.dropped += discarded
+        self.logger.warning("Apply queue overflowed, discarded %d frames, resyncing", discarded)
+        with self.lock:
+            self.stale.update(self.data)
+        self.__send_command("getAccount")
+        self.__send_command("getSymbol", self.symbol)
+
+    def queue_depth(self):
+        '''Frames received but not yet applied (0 unless in pipeline mode).'''
+        return self.__queue.qsize() if self.__queue is not None else 0
+
+    def pipeline_stats(self):
+        if self.__queue is None:
+            return None
+        return {'depth': self.__queue.qsize(),
+                'max_depth': self.max_depth,
+                'received': self.received,
+                'applied': self.applied,
+                'batches': self.batches,
+                'merged': self.merged,
+                'overflows': self.overflows,
+                'dropped': self.dropped,
+                'queue_latency': self.queue_latency.summary()}
 
     def __on_error(self, ws, error):
         if not self.exited:
-            self.logger.error("Error : %s" % error)
+            self.logger.error("Error : %s", error)
             sys.exit(1)
 
     def __on_open(self, ws):
@@ -256,6 +512,52 @@ class BitMEXWebsocket():
         self.logger.info('Websocket Closed')
         sys.exit(1)
 
+def apply_table_message(data, keys, message):
+    '''Apply a realtime table message to data (table -> rows) and keys (table -> key columns).
+
+    There are four possible actions from the WS:
+    'partial' - full table image
+    'insert'  - new row
+    'update'  - update row
+    'delete'  - delete row'''
+    table = message['table']
+    action = message['action']
+    rows = message['data']
+    if action in ('update', 'delete') and table not in keys:
+        return  # No partial yet, so nothing to update. Could happen before push
+    if action == 'partial':
+        # Keys are communicated on partials to let you know how to uniquely identify
+        # an item. We use it for updates.
+        keys[table] = message['keys']
+        # A partial is the full image of the subscription, e.g. one symbol
+        # or account, and replaces the rows matching its filter.
+        match = message.get('filter')
+        if match and table in data:
+            data[table] = [item for item in data[table]
+                           if any(item.get(k) != v for k, v in match.items())] + rows
+        else:
+            data[table] = rows
+    elif action == 'insert':
+        data.setdefault(table, []).extend(rows)
+    elif action == 'update':
+        # Locate the item in the collection and update it.
+        for updateData in rows:
+            item = findItemByKeys(keys[table], data[table], updateData)
+            if not item:
+                continue  # No item found to update. Could happen before push
+            item.update(updateData)
+            # Remove cancelled / filled orders
+            if table == 'order' and item['leavesQty'] <= 0:
+                data[table].remove(item)
+    elif action == 'delete':
+        # Locate the item in the collection and remove it.
+        for deleteData in rows:
+            item = findItemByKeys(keys[table], data[table], deleteData)
+            if item:
+                data[table].remove(item)
+    else:
+        raise Exception("Unknown action: %s" % action)
+
 def findItemByKeys(keys, table, matchData):
     for item in table:
         matched = True
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Latest-value-per-key handoff between a feed and a slower consumer.
+
+A Conflator holds at most one pending value per key.  A feed thread
+put()s every update; an update to a key that the consumer has not read
+yet replaces the pending value and is counted as dropped.  The consumer
+takes everything pending at once with drain() or wait(), so however
+fast the feed ticks it only ever processes the newest state of each
+key, and the work per read is bounded by the number of keys."""
+
+import threading
+
+class Conflator(object):
+
+    def __init__(self, merge=False):
+        """merge=True dict.update()s pending values instead of replacing
+        them, for feeds that send changed fields only."""
+        self.merge = merge
+        self.__lock = threading.Lock()
+        self.__ready = threading.Condition(self.__lock)
+        self.__pending = {}
+        self.updates = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.reads = 0
+
+    def put(self, key, value):
+        with self.__lock:
+            self.updates += 1
+            pending = self.__pending.get(key)
+            if pending is not None:
+                self.dropped += 1
+                if self.merge:
+                    pending.update(value)
+                    return
+            elif self.merge:
+                value = dict(value)
+            self.__pending[key] = value
+            self.__ready.notify()
+
+    def skip(self, n=1):
+        """Count n updates the feed superseded before putting them."""
+        with self.__lock:
+            self.updates += n
+            self.dropped += n
+
+    def drain(self):
+        """{key: latest value} of everything put since the last read."""
+        with self.__lock:
+            return self.__take()
+
+    def wait(self, timeout=None):
+        """Like drain(), but wait up to timeout for something to be pending."""
+        with self.__ready:
+            if not self.__pending:
+                self.__ready.wait(timeout)
+            return self.__take()
+
+    def __take(self):
+        pending = self.__pending
+        self.__pending = {}
+        self.delivered += len(pending)
+        self.reads += 1
+        return pending
+
+    def __len__(self):
+        return len(self.__pending)
+
+    def handler(self):
+        """OKCoinWebsocket channel handler putting data under its channel."""
+        return self.put
+
+    def stats(self):
+        with self.__lock:
+            return {'pending': len(self.__pending),
+                    'updates': self.updates,
+                    'dropped': self.dropped,
+                    'delivered': self.delivered,
+                    'reads': self.reads}
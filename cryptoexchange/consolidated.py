@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Consolidated top of book of each canonical instrument across venues.
+
+Every venue quote of an instrument is kept, and so are the best bid and
+best ask over all venues.  A tick that improves on the best replaces it
+directly; only a tick from the venue currently holding the best price
+that moves it away makes the quote rescan the instrument's venues, so
+an update is O(1) in the common case and O(venues) at worst.  The best
+prices, spread and crossed state are read without scanning anything.
+
+Quotes are keyed by the canonical names of instruments.InstrumentRegistry
+(XBT-20151225, XBT-SPOT), so BitMEX, OKCoin and Bitfinex quotes of the
+same contract land on the same ConsolidatedQuote."""
+
+import logging
+import threading
+
+from .instruments import REGISTRY, canonical_name, parse_date
+
+class ConsolidatedQuote(object):
+
+    """Venue quotes and best bid/ask of one instrument.
+
+    bid and ask are (price, venue) tuples, (None, None) while no venue
+    quotes that side.  They are replaced as a whole, so reading one is
+    always consistent."""
+
+    def __init__(self, canonical):
+        self.canonical = canonical
+        # venue -> (bid, bid_size, ask, ask_size, timestamp)
+        self.venues = {}
+        self.bid = (None, None)
+        self.ask = (None, None)
+
+    def update(self, venue, bid=None, ask=None, bid_size=None, ask_size=None, timestamp=None):
+        """Set the quote of venue. Returns True if the best bid or ask changed."""
+        self.venues[venue] = (bid, bid_size, ask, ask_size, timestamp)
+        before = (self.bid, self.ask)
+        best = self.bid[0]
+        if bid is not None and (best is None or bid > best):
+            self.bid = (bid, venue)
+        elif venue == self.bid[1] and bid != best:
+            self.bid = self.__best(0, max)
+        best = self.ask[0]
+        if ask is not None and (best is None or ask < best):
+            self.ask = (ask, venue)
+        elif venue == self.ask[1] and ask != best:
+            self.ask = self.__best(2, min)
+        return (self.bid, self.ask) != before
+
+    def remove(self, venue):
+        """Drop the quote of venue. Returns True if the best bid or ask changed."""
+        if self.venues.pop(venue, None) is None:
+            return False
+        before = (self.bid, self.ask)
+        if self.bid[1] == venue:
+            self.bid = self.__best(0, max)
+        if self.ask[1] == venue:
+            self.ask = self.__best(2, min)
+        return (self.bid, self.ask) != before
+
+    def __best(self, field, choose):
+        quotes = [(quote[field], venue) for venue, quote in self.venues.items()
+                  if quote[field] is not None]
+        if not quotes:
+            return (None, None)
+        # ties go to the venue that sorts first, whatever the dict order
+        price = choose(price for price, venue in quotes)
+        return (price, min(venue for p, venue in quotes if p == price))
+
+    @property
+    def spread(self):
+        """Best ask minus best bid across venues, None if a side is empty."""
+        bid, ask = self.bid[0], self.ask[0]
+        if bid is None or ask is None:
+            return None
+        return ask - bid
+
+    @property
+    def crossed(self):
+        """True if one venue bids above another venue's offer.
+
+        A venue whose own bid is above its own ask is a bad quote of that
+        venue, not a cross between venues; when it holds both best prices
+        the other venues are compared against it instead."""
+        bid, ask = self.bid[0], self.ask[0]
+        if bid is None or ask is None or bid <= ask:
+            return False
+        venue = self.bid[1]
+        if venue != self.ask[1]:
+            return True
+        return any((quote[0] is not None and quote[0] > ask) or
+                   (quote[2] is not None and quote[2] < bid)
+                   for other, quote in self.venues.items() if other != venue)
+
+    @property
+    def locked(self):
+        bid, ask = self.bid[0], self.ask[0]
+        return bid is not None and bid == ask
+
+class ConsolidatedBook(object):
+
+    """ConsolidatedQuotes of every instrument, fed by any number of venues.
+
+    Listeners are called as fn(canonical, quote) after a tick changes the
+    best bid or ask of an instrument.  The set of crossed instruments is
+    maintained as quotes change."""
+
+    def __init__(self, registry=REGISTRY):
+        self.logger = logging.getLogger('root')
+        self.registry = registry
+        self.lock = threading.Lock()
+        self.quotes = {}
+        self.__crossed = set()
+        self.__listeners = []
+
+    def subscribe(self, fn):
+        self.__listeners.append(fn)
+
+    def unsubscribe(self, fn):
+        self.__listeners.remove(fn)
+
+    def update(self, canonical, venue, bid=None, ask=None, bid_size=None, ask_size=None,
+               timestamp=None):
+        """Apply a venue tick. Returns True if the best bid or ask changed."""
+        with self.lock:
+            quote = self.quotes.get(canonical)
+            if quote is None:
+                quote = self.quotes[canonical] = ConsolidatedQuote(canonical)
+            changed = quote.update(venue, bid, ask, bid_size, ask_size, timestamp)
+            # a venue other than the best can cross one that holds both sides
+            self.__check_crossed(quote)
+        if changed:
+            for fn in self.__listeners:
+                fn(canonical, quote)
+        return changed
+
+    def update_symbol(self, exchange, symbol, bid=None, ask=None, bid_size=None,
+                      ask_size=None, timestamp=None):
+        """Apply a tick of an exchange symbol known to the registry.
+
+        Returns False, without recording the tick, for unknown symbols."""
+        instrument = self.registry.lookup(exchange, symbol)
+        if instrument is None:
+            return False
+        return self.update(instrument.canonical, exchange, bid, ask, bid_size, ask_size,
+                           timestamp)
+
+    def remove_venue(self, venue):
+        """Drop every quote of a venue, e.g. when its connection is lost."""
+        changed = []
+        with self.lock:
+            for canonical, quote in self.quotes.items():
+                if quote.remove(venue):
+                    changed.append(quote)
+                self.__check_crossed(quote)
+        for quote in changed:
+            for fn in self.__listeners:
+                fn(quote.canonical, quote)
+
+    def __check_crossed(self, quote):
+        if quote.crossed:
+            self.__crossed.add(quote.canonical)
+        else:
+            self.__crossed.discard(quote.canonical)
+
+    #
+    # Queries
+    #
+    def quote(self, canonical):
+        return self.quotes.get(canonical)
+
+    def best_bid(self, canonical):
+        """(price, venue) of the best bid of an instrument."""
+        quote = self.quotes.get(canonical)
+        return quote.bid if quote is not None else (None, None)
+
+    def best_ask(self, canonical):
+        """(price, venue) of the best ask of an instrument."""
+        quote = self.quotes.get(canonical)
+        return quote.ask if quote is not None else (None, None)
+
+    def spread(self, canonical):
+        quote = self.quotes.get(canonical)
+        return quote.spread if quote is not None else None
+
+    def is_crossed(self, canonical):
+        return canonical in self.__crossed
+
+    def crossed(self):
+        """Canonical names of the instruments crossed across venues."""
+        return sorted(self.__crossed)
+
+    def summary(self):
+        """{canonical: {'bid', 'bid_venue', 'ask', 'ask_venue', 'spread', 'crossed'}}"""
+        return {canonical: {'bid': quote.bid[0], 'bid_venue': quote.bid[1],
+                            'ask': quote.ask[0], 'ask_venue': quote.ask[1],
+                            'spread': quote.spread, 'crossed': quote.crossed}
+                for canonical, quote in list(self.quotes.items())}
+
+    #
+    # Sources
+    #
+    def load(self, data):
+        """Apply the futures quotes of a bitfutures.get_data snapshot."""
+        for exchange, entry in data['futures'].items():
+            contracts = entry.get('contract') or ['XBT'] * len(entry['dates'])
+            for root, date, bid, ask in zip(contracts, entry['dates'], entry['bids'],
+                                            entry['asks']):
+                self.update(canonical_name(root, parse_date(date)), exchange,
+                            _price(bid), _price(ask))
+
+    def attach_bitmex(self, ws):
+        """Follow the quotes of a BitMEXWebsocket (see BitMEXWebsocket.add_listener)."""
+        for row in ws.data.get('instrument', []):
+            self.registry.bitmex(row)
+        for row in ws.data.get('quote', [])[-1:]:
+            self.bitmex_quote(row)
+        ws.add_listener(self.__bitmex_table)
+
+    def __bitmex_table(self, table, action, rows):
+        if table == 'quote' and action in ('partial', 'insert'):
+            # only the last quote of each symbol in a message matters
+            last = {}
+            for row in rows:
+                last[row['symbol']] = row
+            for row in last.values():
+                self.bitmex_quote(row)
+        elif table == 'instrument' and action in ('partial', 'insert'):
+            for row in rows:
+                self.registry.bitmex(row)
+
+    def bitmex_quote(self, row):
+        return self.update_symbol('bitmex', row['symbol'], row.get('bidPrice'),
+                                  row.get('askPrice'), row.get('bidSize'),
+                                  row.get('askSize'), row.get('timestamp'))
+
+    def attach_okcoin(self, okws, symbol="btcusd", contracts=('this_week', 'next_week', 'quarter'),
+                      venue="okcoin", convert=None):
+        """Subscribe an OKCoinWebsocket to the spot ticker and future tickers of symbol.
+
+        convert, if given, maps OKCoin prices into the currency of the
+        other venues (for okcoin.cn, CNY to USD)."""
+        okws.subscribe("ok_%s_ticker" % symbol,
+                       lambda channel, data: self.okcoin_ticker(data, 'XBT-SPOT', venue, convert))
+        for contract in contracts:
+            okws.subscribe("ok_%s_future_ticker_%s" % (symbol, contract),
+                           lambda channel, data, contract=contract:
+                           self.okcoin_future_ticker(data, contract, venue, convert))
+
+    def okcoin_ticker(self, data, canonical, venue="okcoin", convert=None):
+        """Apply an OKCoin ticker dict (websocket data or REST 'ticker')."""
+        if not isinstance(data, dict) or 'buy' not in data:
+            return False
+        bid, ask = float(data['buy']), float(data['sell'])
+        if convert is not None:
+            bid, ask = convert(bid), convert(ask)
+        return self.update(canonical, venue, bid, ask, timestamp=data.get('timestamp'))
+
+    def okcoin_future_ticker(self, data, contract_type, venue="okcoin", convert=None):
+        """Apply an OKCoin future ticker of a contract type such as 'this_week'.
+
+        The ticker's contractId gives the expiry, and aliases the contract
+        type to it in the registry, so the quote lands on the same canonical
+        instrument as get_data and BitMEX quotes."""
+        if not isinstance(data, dict) or 'buy' not in data:
+            return False
+        if data.get('contractId'):
+            instrument = self.registry.okcoin(data['contractId'], contract_type)
+        else:
+            instrument = self.registry.lookup('okcoin', contract_type)
+            if instrument is None:
+                return False
+        return self.okcoin_ticker(data, instrument.canonical, venue, convert)
+
+    def poll_okcoin(self, spot, symbol="btc_usd", venue="okcoin", convert=None):
+        """Apply one REST ticker of an OKCoinSpot client."""
+        data = spot.ticker(symbol)
+        return self.okcoin_ticker(data.get('ticker'), 'XBT-SPOT', venue, convert)
+
+    def poll_bitfinex(self, symbol="btcusd"):
+        """Apply one REST ticker of Bitfinex spot."""
+        from .bitfutures import bitfinex_ticker
+        data = bitfinex_ticker(symbol).result()
+        return self.update('XBT-SPOT', 'bitfinex', float(data['bid']), float(data['ask']),
+                           timestamp=data.get('timestamp'))
+
+def _price(value):
+    if value is None:
+        return None
+    value = float(value)
+    # get_data carries missing quotes as nan
+    return None if value != value else value
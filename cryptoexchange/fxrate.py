@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+import logging
+import threading
+import time
+
+class RateProvider(object):
+
+    """An exchange rate held in memory and refreshed by a background thread.
+
+    Reading rate never blocks: it returns the last fetched value, or
+    default until the first fetch succeeds.  The refresh thread starts on
+    the first read and refetches every ttl seconds, or every retry
+    seconds after a failure.  After stop() it runs again only once
+    start() is called."""
+
+    def __init__(self, fetch, default, ttl=300.0, retry=30.0, name='rate'):
+        self.logger = logging.getLogger('root')
+        self.fetch = fetch
+        self.ttl = ttl
+        self.retry = retry
+        self.name = name
+        self.updated = None
+        self.default = float(default)
+        self.__rate = self.default
+        self.__thread = None
+        self.__stop = None
+        self.__stopped = False
+        self.__lock = threading.Lock()
+
+    @property
+    def rate(self):
+        if self.__thread is None and not self.__stopped:
+            self.start()
+        return self.__rate
+
+    def age(self):
+        """Seconds since the last successful fetch, or None."""
+        return None if self.updated is None else time.time() - self.updated
+
+    def refresh(self):
+        """Fetch the rate now. Returns True on success."""
+        try:
+            rate = float(self.fetch())
+        except Exception:
+            self.logger.warning("Unable to refresh %s" % self.name, exc_info=True)
+            return False
+        if not rate > 0:
+            self.logger.warning("Ignoring %s of %s" % (self.name, rate))
+            return False
+        self.__rate = rate
+        self.updated = time.time()
+        return True
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is None:
+                self.__stopped = False
+                # each thread has its own event, so one still finishing a
+                # fetch after stop() can't be revived by a later start()
+                self.__stop = threading.Event()
+                self.__thread = threading.Thread(target=self.__run, args=(self.__stop,))
+                self.__thread.daemon = True
+                self.__thread.start()
+
+    def stop(self):
+        with self.__lock:
+            self.__stopped = True
+            if self.__thread is not None:
+                self.__stop.set()
+                self.__thread = None
+                self.__stop = None
+
+    def __run(self, stop):
+        while not stop.is_set():
+            stop.wait(self.ttl if self.refresh() else self.retry)
+
+    def convert(self, values, rate=None):
+        """Divide values by the rate, e.g. CNY prices into USD for USDCNY."""
+        import numpy as np
+        return np.asarray(values, dtype=float) / (rate or self.rate)
+
+    def invert(self, values, rate=None):
+        """Multiply values by the rate, e.g. USD prices into CNY for USDCNY."""
+        import numpy as np
+        return np.asarray(values, dtype=float) * (rate or self.rate)
+
+def okcoin_usdcny():
+    from .OkcoinFutureAPI import OKCoinFuture
+    return OKCoinFuture('www.okcoin.com', '', '').exchange_rate()['rate']
+
+USDCNY = RateProvider(okcoin_usdcny, default=6.41, name='USDCNY')
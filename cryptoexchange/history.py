@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Append-only columnar store for futures curve snapshots.
+
+Each exchange has a directory holding one raw little-endian file per
+column.  Rows are appended in timestamp order, so the timestamp column
+is itself the time index: a range is found by binary search and
+returned as slices of read-only memory maps, without reading or copying
+the rest of the file.
+
+    path/meta.json
+    path/<exchange>/timestamp  float64 seconds since the epoch
+    path/<exchange>/contract   4 byte ascii root symbol
+    path/<exchange>/expiry     datetime64[D]
+    path/<exchange>/bid, ask, last, spot  float64"""
+
+import json
+import os
+import numpy as np
+
+from .basis import curve_table, CURVE_DTYPE
+
+VERSION = 1
+COLUMNS = [('timestamp', '<f8'),
+           ('contract', 'S4'),
+           ('expiry', '<M8[D]'),
+           ('bid', '<f8'),
+           ('ask', '<f8'),
+           ('last', '<f8'),
+           ('spot', '<f8')]
+
+def _write_meta(path):
+    meta = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta):
+        with open(meta, 'w') as f:
+            json.dump({'version': VERSION, 'columns': COLUMNS}, f)
+
+class CurveHistoryWriter(object):
+
+    """Append get_data snapshots to a history directory."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        _write_meta(path)
+        self.__files = {}
+        self.__last = {}
+
+    def __columns(self, exchange):
+        files = self.__files.get(exchange)
+        if files is None:
+            directory = os.path.join(self.path, exchange)
+            os.makedirs(directory, exist_ok=True)
+            reader = CurveHistory(self.path)
+            timestamps = reader.column(exchange, 'timestamp')
+            self.__last[exchange] = timestamps[-1] if len(timestamps) else -np.inf
+            # drop the partial rows a crash during append may have left, so
+            # that the columns stay aligned once appended to
+            rows = len(timestamps)
+            files = {}
+            for name, dtype in COLUMNS:
+                f = open(os.path.join(directory, name), 'ab')
+                f.truncate(rows * np.dtype(dtype).itemsize)
+                files[name] = f
+            self.__files[exchange] = files
+        return files
+
+    def append(self, data, timestamp=None):
+        """Append a get_data snapshot. Timestamps must not go backwards."""
+        return self.append_table(curve_table(data, timestamp))
+
+    def append_table(self, table):
+        """Append the rows of a basis.curve_table."""
+        for exchange in np.unique(table['exchange']):
+            rows = table[table['exchange'] == exchange]
+            files = self.__columns(str(exchange))
+            if rows['timestamp'][0] < self.__last[str(exchange)] or \
+               np.any(np.diff(rows['timestamp']) < 0):
+                raise ValueError("History of %s must be appended in time order" % exchange)
+            for name, dtype in COLUMNS:
+                files[name].write(np.ascontiguousarray(rows[name], dtype=dtype).tobytes())
+            for name, dtype in COLUMNS:
+                files[name].flush()
+            self.__last[str(exchange)] = rows['timestamp'][-1]
+        return len(table)
+
+    def close(self):
+        for files in self.__files.values():
+            for f in files.values():
+                f.close()
+        self.__files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CurveHistory(object):
+
+    """Read a history directory through memory maps."""
+
+    def __init__(self, path):
+        self.path = path
+        self.__maps = {}
+
+    def exchanges(self):
+        return sorted(name for name in os.listdir(self.path)
+                      if os.path.isdir(os.path.join(self.path, name)))
+
+    def __open(self, exchange):
+        directory = os.path.join(self.path, exchange)
+        sizes = {}
+        for name, dtype in COLUMNS:
+            filename = os.path.join(directory, name)
+            sizes[name] = os.path.getsize(filename) if os.path.exists(filename) else 0
+        # a crash during append can leave some columns a row longer
+        rows = min(sizes[name] // np.dtype(dtype).itemsize for name, dtype in COLUMNS)
+        cached = self.__maps.get(exchange)
+        if cached is not None and cached[0] == rows:
+            return cached[1]
+        columns = {}
+        for name, dtype in COLUMNS:
+            if rows:
+                columns[name] = np.memmap(os.path.join(directory, name), dtype=dtype,
+                                          mode='r', shape=(rows,))
+            else:
+                columns[name] = np.zeros(0, dtype=dtype)
+        self.__maps[exchange] = (rows, columns)
+        return columns
+
+    def column(self, exchange, name):
+        return self.__open(exchange)[name]
+
+    def __len__(self):
+        return sum(len(self.column(exchange, 'timestamp')) for exchange in self.exchanges())
+
+    def slice(self, exchange, start=None, end=None):
+        """Columns of exchange for start <= timestamp < end, as views of the maps."""
+        columns = self.__open(exchange)
+        timestamps = columns['timestamp']
+        i = 0 if start is None else int(np.searchsorted(timestamps, start, 'left'))
+        j = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, 'left'))
+        return {name: column[i:j] for name, column in columns.items()}
+
+    def table(self, start=None, end=None, exchanges=None):
+        """Copy a time range of several exchanges into a basis.curve_table array."""
+        tables = []
+        for exchange in exchanges or self.exchanges():
+            columns = self.slice(exchange, start, end)
+            table = np.zeros(len(columns['timestamp']), dtype=CURVE_DTYPE)
+            table['exchange'] = exchange
+            for name, dtype in COLUMNS:
+                table[name] = columns[name]
+            table['days'] = (table['expiry'].astype('M8[s]').astype('f8') - table['timestamp']) / 86400.0
+            tables.append(table)
+        if not tables:
+            return np.zeros(0, dtype=CURVE_DTYPE)
+        table = np.concatenate(tables)
+        table = table[np.argsort(table['timestamp'], kind='stable')]
+        # number snapshots by distinct timestamp
+        table['snapshot'] = np.unique(table['timestamp'], return_inverse=True)[1]
+        return table
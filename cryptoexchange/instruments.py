@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Canonical futures instruments and a precomputed expiry calendar.
+
+Every exchange names its contracts differently: BitMEX by symbol
+(XBTZ15) with an ISO expiry, OKCoin by contractId (20151225013) or by
+contract type (this_week), bitvc and 796 by contract type only.  The
+registry maps each (exchange, name) to an Instrument carrying the
+exchange's tick size and a canonical name (XBT-20151225) that is the
+same on every exchange."""
+
+import bisect
+import collections
+import datetime
+import threading
+
+# Expiries fall on this weekday (Saturday), as in bitfutures
+EXPIRY_WEEKDAY = 5
+
+Instrument = collections.namedtuple('Instrument', ['canonical', 'root', 'expiry', 'tick_size'])
+
+def canonical_name(root, expiry=None):
+    if expiry is None:
+        return root + '-SPOT'
+    return root + '-' + expiry.strftime("%Y%m%d")
+
+def parse_date(s):
+    """Date of an ISO timestamp ('2015-12-25T12:00:00.000Z') or yyyymmdd contractId."""
+    s = str(s)
+    if s[4:5] == '-':
+        return datetime.date(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    return datetime.date(int(s[0:4]), int(s[4:6]), int(s[6:8]))
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def parse_timestamp(s):
+    """Seconds since the epoch of a UTC ISO timestamp ('2015-12-25T12:00:00.000Z')."""
+    t = datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                          int(s[11:13]), int(s[14:16]), int(s[17:19]),
+                          int((s[20:23] + '000')[:3]) * 1000 if s[19:20] == '.' else 0)
+    return (t - _EPOCH).total_seconds()
+
+class ExpiryCalendar(object):
+
+    """Weekly and quarterly expiries precomputed for a range of years.
+
+    weekly() is a bisect into the sorted weekly dates and quarterly() a
+    dict lookup.  The range grows on demand if a date outside it is
+    asked for."""
+
+    def __init__(self, first_year=None, years=10):
+        if first_year is None:
+            first_year = datetime.date.today().year - 1
+        self.__lock = threading.Lock()
+        self.first_year = first_year
+        self.last_year = first_year - 1
+        self.weeks = []
+        self.quarters = {}
+        self.__extend(first_year, first_year + years - 1)
+
+    def __extend(self, first_year, last_year):
+        first_year = min(first_year, self.first_year)
+        last_year = max(last_year, self.last_year)
+        d = datetime.date(first_year, 1, 1)
+        d += datetime.timedelta((EXPIRY_WEEKDAY - d.weekday()) % 7)
+        end = datetime.date(last_year + 1, 1, 15)
+        weeks = []
+        while d < end:
+            weeks.append(d)
+            d += datetime.timedelta(7)
+        quarters = {}
+        for year in range(first_year, last_year + 1):
+            for quarter, (month, day) in enumerate([(3, 31), (6, 30), (9, 30), (12, 31)]):
+                d = datetime.date(year, month, day)
+                quarters[(year, quarter)] = d - datetime.timedelta((d.weekday() - EXPIRY_WEEKDAY) % 7)
+        self.weeks = weeks
+        self.quarters = quarters
+        self.first_year = first_year
+        self.last_year = last_year
+
+    def __cover(self, ref):
+        if not self.first_year <= ref.year <= self.last_year:
+            with self.__lock:
+                self.__extend(ref.year, ref.year)
+
+    def weekly(self, ref=None, offset=0):
+        """First expiry on or after ref, or offset weeks after it."""
+        ref = ref or datetime.date.today()
+        self.__cover(ref)
+        return self.weeks[bisect.bisect_left(self.weeks, ref) + offset]
+
+    def quarterly(self, ref=None):
+        """Last expiry weekday on or before the end of ref's quarter."""
+        ref = ref or datetime.date.today()
+        self.__cover(ref)
+        return self.quarters[(ref.year, (ref.month - 1) // 3)]
+
+CALENDAR = ExpiryCalendar()
+
+# relative contract type -> expiry for a reference date
+RELATIVE_EXPIRY = {
+    'this_week': lambda ref: CALENDAR.weekly(ref),
+    'week': lambda ref: CALENDAR.weekly(ref),
+    'weekly': lambda ref: CALENDAR.weekly(ref),
+    'next_week': lambda ref: CALENDAR.weekly(ref, 1),
+    'quarter': lambda ref: CALENDAR.quarterly(ref)
+}
+
+TICK_SIZE = {
+    'okcoin': 0.01,
+    '796': 0.01,
+    '796CNY': 0.01,
+    'bitvc': 0.01
+}
+
+class InstrumentRegistry(object):
+
+    """Map (exchange, symbol) to canonical Instruments with O(1) lookup."""
+
+    def __init__(self):
+        self.__symbols = {}
+        self.__canonical = {}
+
+    def add(self, exchange, symbol, root, expiry=None, tick_size=None):
+        instrument = Instrument(canonical_name(root, expiry), root, expiry, tick_size)
+        self.__canonical.setdefault(instrument.canonical, set()).add((exchange, symbol))
+        self.__symbols[(exchange, symbol)] = instrument
+        return instrument
+
+    def lookup(self, exchange, symbol):
+        """Instrument registered for symbol, or None."""
+        return self.__symbols.get((exchange, symbol))
+
+    def symbols(self, canonical):
+        """(exchange, symbol) pairs registered under a canonical name."""
+        return sorted(self.__canonical.get(canonical, ()), key=str)
+
+    def relative(self, exchange, contract_type, root='XBT', ref=None):
+        """Resolve a relative contract type such as 'this_week' for the date ref.
+
+        Instruments are registered per (contract type, expiry), so there is
+        one entry per contract and not one per day asked about.  Resolving
+        for today also points the plain contract type at the instrument,
+        so that lookup(exchange, contract_type) finds it."""
+        today = datetime.date.today()
+        expiry = RELATIVE_EXPIRY[contract_type](ref or today)
+        symbol = (contract_type, expiry)
+        instrument = self.__symbols.get((exchange, symbol))
+        if instrument is None:
+            instrument = self.add(exchange, symbol, root, expiry, TICK_SIZE.get(exchange))
+        if ref is None or ref == today:
+            self.__alias(exchange, contract_type, instrument)
+        return instrument
+
+    def bitmex(self, row):
+        """Register a row of the BitMEX instrument endpoint."""
+        instrument = self.lookup('bitmex', row['symbol'])
+        if instrument is None:
+            expiry = parse_date(row['expiry']) if row.get('expiry') else None
+            instrument = self.add('bitmex', row['symbol'], row['rootSymbol'], expiry,
+                                  row.get('tickSize'))
+        return instrument
+
+    def okcoin(self, contractId, contract_type=None, root='XBT'):
+        """Register an OKCoin contractId, aliased by its current contract type."""
+        symbol = str(contractId)
+        instrument = self.lookup('okcoin', symbol)
+        if instrument is None:
+            instrument = self.add('okcoin', symbol, root, parse_date(symbol), TICK_SIZE['okcoin'])
+        if contract_type is not None:
+            self.__alias('okcoin', contract_type, instrument)
+        return instrument
+
+    def __alias(self, exchange, symbol, instrument):
+        # point a moving name such as 'this_week' at instrument
+        previous = self.__symbols.get((exchange, symbol))
+        if previous is instrument:
+            return
+        if previous is not None:
+            self.__canonical[previous.canonical].discard((exchange, symbol))
+        self.__symbols[(exchange, symbol)] = instrument
+        self.__canonical[instrument.canonical].add((exchange, symbol))
+
+REGISTRY = InstrumentRegistry()
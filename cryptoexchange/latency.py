@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+import collections
+import math
+
+class LatencyStats(object):
+
+    """Latency samples over a rolling window with bounded memory."""
+
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p, ordered=None):
+        """Nearest-rank percentile of the window, p in [0, 100]."""
+        if ordered is None:
+            ordered = sorted(self.samples)
+        if not ordered:
+            return None
+        rank = max(int(math.ceil(p / 100.0 * len(ordered))) - 1, 0)
+        return ordered[rank]
+
+    def summary(self):
+        """Count, mean and max since creation; percentiles over the window."""
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50, ordered),
+            'p90': self.percentile(90, ordered),
+            'p99': self.percentile(99, ordered),
+            'max': self.max if self.count else None
+        }
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Move log output off the network threads.
+
+start_queue_logging() replaces the handlers of a logger with a handler
+that only puts records on a bounded queue; a background QueueListener
+formats them and runs the original handlers.  A slow disk or terminal
+then delays the listener, never the websocket or REST thread.
+
+When the queue is more than sample_above full, only one in sample_rate
+records below WARNING is kept, and when it is full records are dropped.
+Both are counted and reported by stats()."""
+
+import copy
+import logging
+import logging.handlers
+import queue
+import threading
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+
+    """QueueHandler that never blocks and leaves formatting, apart from
+    merging msg and args, to the listener thread."""
+
+    def __init__(self, q, sample_above=0.5, sample_rate=10):
+        logging.handlers.QueueHandler.__init__(self, q)
+        self.sample_above = sample_above
+        self.sample_rate = sample_rate
+        self.enqueued = 0
+        self.sampled = 0
+        self.dropped = 0
+        self.__seen = 0
+        self.__lock = threading.Lock()
+
+    def prepare(self, record):
+        # Merge msg and args now, as the stdlib QueueHandler does, since the
+        # args may change before the listener gets to them.  The queue stays
+        # in process, so the traceback is still formatted on the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        q = self.queue
+        if q.maxsize and record.levelno < logging.WARNING and \
+           q.qsize() >= q.maxsize * self.sample_above:
+            with self.__lock:
+                self.__seen += 1
+                if self.__seen % self.sample_rate:
+                    self.sampled += 1
+                    return
+        try:
+            q.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            with self.__lock:
+                self.dropped += 1
+
+class QueueLogging(object):
+
+    """The queue, handler and listener installed on a logger."""
+
+    def __init__(self, logger, maxsize, sample_above, sample_rate):
+        self.logger = logger
+        self.queue = queue.Queue(maxsize)
+        self.handlers = logger.handlers[:]
+        self.handler = DroppingQueueHandler(self.queue, sample_above, sample_rate)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers,
+                                                       respect_handler_level=True)
+
+    def start(self):
+        for handler in self.handlers:
+            self.logger.removeHandler(handler)
+        self.logger.addHandler(self.handler)
+        self.listener.start()
+        return self
+
+    def stop(self):
+        """Flush the queue and put the original handlers back."""
+        self.logger.removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            self.logger.addHandler(handler)
+
+    def stats(self):
+        return {'depth': self.queue.qsize(),
+                'maxsize': self.queue.maxsize,
+                'enqueued': self.handler.enqueued,
+                'sampled': self.handler.sampled,
+                'dropped': self.handler.dropped}
+
+def start_queue_logging(logger=None, maxsize=10000, sample_above=0.5, sample_rate=10):
+    """Route logger (the root logger by default) through a background writer.
+
+    The clients log to logging.getLogger('root'), which propagates to the
+    root logger, so the default covers all of them."""
+    if logger is None:
+        logger = logging.getLogger()
+    return QueueLogging(logger, maxsize, sample_above, sample_rate).start()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Request counts, errors, retries and latency per exchange and endpoint.
+
+The REST clients report every HTTP attempt to METRICS.  Recording is a
+lock acquire, a few additions and a bisect into fixed histogram buckets,
+so it is cheap enough to leave on.  snapshot() returns the numbers as a
+dict and dump() writes them as json."""
+
+import bisect
+import contextlib
+import json
+import sys
+import threading
+import time
+
+# histogram bucket upper bounds in seconds, plus one overflow bucket
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class EndpointMetrics(object):
+
+    """Counters and latency histogram of one endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.retries = 0
+        self.errors = {}
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def record(self, seconds, error=None, retry=False):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self.lock:
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.buckets[bucket] += 1
+            if retry:
+                self.retries += 1
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding quantile q (inf for overflow)."""
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+        return None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'errors': dict(self.errors),
+                'error_count': sum(self.errors.values()),
+                'retries': self.retries,
+                'mean': self.total / self.count if self.count else None,
+                'max': self.max if self.count else None,
+                'p50': self.quantile(0.5),
+                'p90': self.quantile(0.9),
+                'p99': self.quantile(0.99),
+                # [upper bound, count] pairs, 'inf' for the overflow bucket
+                'buckets': [[b, n] for b, n in zip(list(BUCKETS) + ['inf'], self.buckets)]
+            }
+
+class Metrics(object):
+
+    """EndpointMetrics keyed by (exchange, endpoint)."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__endpoints = {}
+
+    def endpoint(self, exchange, endpoint):
+        key = (exchange, endpoint)
+        metrics = self.__endpoints.get(key)
+        if metrics is None:
+            with self.__lock:
+                metrics = self.__endpoints.setdefault(key, EndpointMetrics())
+        return metrics
+
+    def record(self, exchange, endpoint, seconds, error=None, retry=False):
+        self.endpoint(exchange, endpoint).record(seconds, error, retry)
+
+    @contextlib.contextmanager
+    def timed(self, exchange, endpoint):
+        """Time the block, recording the class of any exception it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(exchange, endpoint, time.perf_counter() - start, type(e).__name__)
+            raise
+        self.record(exchange, endpoint, time.perf_counter() - start)
+
+    def snapshot(self, exchange=None):
+        """{exchange: {endpoint: stats}}"""
+        retval = {}
+        for (name, endpoint), metrics in sorted(list(self.__endpoints.items())):
+            if exchange is None or name == exchange:
+                retval.setdefault(name, {})[endpoint] = metrics.snapshot()
+        return retval
+
+    def dump(self, fp=None):
+        """Write the snapshot as json to fp (stdout by default)."""
+        json.dump(self.snapshot(), fp or sys.stdout, indent=2, sort_keys=True)
+
+    def reset(self):
+        with self.__lock:
+            self.__endpoints = {}
+
+METRICS = Metrics()
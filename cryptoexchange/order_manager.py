@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Local book of open BitMEX orders kept current by the websocket.
+
+An OrderManager holds every open order once, indexed by orderID, by
+clOrdID and by each registered clOrdID prefix, so looking up an order
+or the open orders of a strategy never scans or calls REST.
+
+    BitMEX.place_order   adds the order at once as PendingNew
+                         (through BitMEX.add_order_listener)
+    order, execution     websocket deltas update it and remove it when
+                         it is filled, cancelled or rejected
+    order partial        the websocket's full image of the open orders,
+                         sent on (re)connect, replaces the local state
+
+reconcile_rest() does the same from the REST order endpoint for when
+the websocket image is not available."""
+
+import logging
+import threading
+import time
+
+TERMINAL = frozenset(['Filled', 'Canceled', 'Rejected'])
+
+# fields of an execution row that describe the state of its order
+EXECUTION_FIELDS = ('orderID', 'clOrdID', 'ordStatus', 'leavesQty', 'cumQty', 'avgPx',
+                    'workingIndicator', 'text', 'timestamp')
+
+def is_closed(order):
+    leavesQty = order.get('leavesQty')
+    return order.get('ordStatus') in TERMINAL or (leavesQty is not None and leavesQty <= 0)
+
+class OrderManager(object):
+
+    def __init__(self, prefixes=(), ack_timeout=60.0):
+        """Orders submitted but still unacknowledged ack_timeout seconds
+        later are dropped by the next reconcile()."""
+        self.logger = logging.getLogger('root')
+        self.ack_timeout = ack_timeout
+        self.lock = threading.RLock()
+        self.byOrderID = {}
+        self.byClOrdID = {}
+        self.byPrefix = {prefix: {} for prefix in prefixes}
+        self.reconciles = 0
+
+    def attach(self, bitmex=None, ws=None):
+        """Follow the orders placed through bitmex and the order tables of ws."""
+        if bitmex is not None:
+            self.add_prefix(bitmex.orderIDPrefix)
+            bitmex.add_order_listener(self)
+        if ws is not None:
+            with ws.lock:
+                if 'order' in ws.data:
+                    self.reconcile(ws.data['order'])
+                ws.add_listener(self.on_table)
+        return self
+
+    def add_prefix(self, prefix):
+        """Index the open orders whose clOrdID starts with prefix."""
+        with self.lock:
+            if prefix not in self.byPrefix:
+                self.byPrefix[prefix] = {clOrdID: order for clOrdID, order in self.byClOrdID.items()
+                                         if clOrdID.startswith(prefix)}
+
+    #
+    # Index maintenance
+    #
+    def __add(self, order):
+        if order.get('orderID'):
+            self.byOrderID[order['orderID']] = order
+        clOrdID = order.get('clOrdID')
+        if clOrdID:
+            self.byClOrdID[clOrdID] = order
+            for prefix, orders in self.byPrefix.items():
+                if clOrdID.startswith(prefix):
+                    orders[clOrdID] = order
+
+    def __remove(self, order):
+        self.byOrderID.pop(order.get('orderID'), None)
+        clOrdID = order.get('clOrdID')
+        if clOrdID:
+            self.byClOrdID.pop(clOrdID, None)
+            for orders in self.byPrefix.values():
+                orders.pop(clOrdID, None)
+
+    def __find(self, row):
+        order = self.byOrderID.get(row.get('orderID'))
+        if order is None and row.get('clOrdID'):
+            order = self.byClOrdID.get(row['clOrdID'])
+        return order
+
+    def __merge(self, row):
+        order = self.__find(row)
+        if order is None:
+            if not is_closed(row):
+                self.__add(dict(row))
+            return
+        hadOrderID = order.get('orderID')
+        order.update(row)
+        if is_closed(order):
+            self.__remove(order)
+        elif not hadOrderID and order.get('orderID'):
+            self.byOrderID[order['orderID']] = order
+
+    #
+    # BitMEX order listener
+    #
+    def submitted(self, clOrdID, postdict):
+        quantity = postdict['quantity']
+        with self.lock:
+            self.__add({'clOrdID': clOrdID,
+                        'symbol': postdict['symbol'],
+                        'side': 'Buy' if quantity > 0 else 'Sell',
+                        'orderQty': abs(quantity),
+                        'leavesQty': abs(quantity),
+                        'cumQty': 0,
+                        'price': postdict['price'],
+                        'ordStatus': 'PendingNew',
+                        'submitted': time.time()})
+
+    def responded(self, clOrdID, response):
+        with self.lock:
+            if isinstance(response, dict) and response.get('orderID') and 'error' not in response:
+                self.__merge(response)
+                return
+            order = self.byClOrdID.get(clOrdID)
+            if order is not None and not order.get('orderID'):
+                # the request failed or was refused, the exchange never acknowledged it
+                self.logger.warning("Dropping order %s, submit failed: %s", clOrdID, response)
+                order['ordStatus'] = 'Rejected'
+                self.__remove(order)
+
+    #
+    # BitMEXWebsocket listener
+    #
+    def on_table(self, table, action, rows):
+        if table == 'order':
+            if action == 'partial':
+                self.reconcile(rows)
+            elif action in ('insert', 'update'):
+                with self.lock:
+                    for row in rows:
+                        self.__merge(row)
+            elif action == 'delete':
+                with self.lock:
+                    for row in rows:
+                        order = self.__find(row)
+                        if order is not None:
+                            self.__remove(order)
+        elif table == 'execution' and action in ('partial', 'insert'):
+            with self.lock:
+                for row in rows:
+                    self.__merge({k: row[k] for k in EXECUTION_FIELDS if k in row})
+
+    def reconcile(self, rows):
+        """Replace the local state with a full list of open orders.
+
+        Orders submitted but not yet acknowledged are kept, unless they
+        were submitted more than ack_timeout seconds ago."""
+        expired = time.time() - self.ack_timeout
+        with self.lock:
+            unacked = []
+            for order in self.byClOrdID.values():
+                if order.get('orderID'):
+                    continue
+                if order.get('submitted', 0) < expired:
+                    self.logger.warning("Dropping order %s, never acknowledged", order['clOrdID'])
+                else:
+                    unacked.append(order)
+            self.byOrderID = {}
+            self.byClOrdID = {}
+            self.byPrefix = {prefix: {} for prefix in self.byPrefix}
+            for row in rows:
+                if not is_closed(row):
+                    self.__add(dict(row))
+            for order in unacked:
+                if order['clOrdID'] not in self.byClOrdID:
+                    self.__add(order)
+            self.reconciles += 1
+
+    def reconcile_rest(self, bitmex, symbol=None):
+        """Reconcile with the open orders of the REST order endpoint."""
+        self.reconcile(bitmex.open_orders(symbol) or [])
+
+    #
+    # Queries
+    #
+    def get(self, orderID):
+        return self.byOrderID.get(orderID)
+
+    def get_by_clOrdID(self, clOrdID):
+        return self.byClOrdID.get(clOrdID)
+
+    def open_orders(self, prefix=None):
+        """Open orders, only those whose clOrdID starts with prefix if given."""
+        with self.lock:
+            if prefix is None:
+                orders = {id(order): order for order in self.byOrderID.values()}
+                orders.update((id(order), order) for order in self.byClOrdID.values())
+                return list(orders.values())
+            if prefix not in self.byPrefix:
+                self.add_prefix(prefix)
+            return list(self.byPrefix[prefix].values())
+
+    def __len__(self):
+        return len(self.open_orders())
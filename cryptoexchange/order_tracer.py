@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+"""Follow BitMEX orders from REST submit to websocket fill by clOrdID.
+
+The tracer is registered with BitMEX.add_order_listener(), which tells
+it when place_order() sends an order and when the HTTP response comes
+back, and with BitMEXWebsocket.add_listener(), through which the order
+ack and executions arrive.  Each order's timestamps yield one sample
+per stage:
+
+    http       submit to HTTP response
+    ack        submit to the order appearing on the websocket
+    ack_lead   HTTP response to websocket ack, negative when the
+               websocket is faster than the response
+    fill       websocket ack to first fill
+
+Orders are forgotten once filled, cancelled or rejected, and the oldest
+are evicted beyond max_pending, so memory stays bounded even for
+orders that rest on the book forever."""
+
+import collections
+import threading
+import time
+
+from .latency import LatencyStats
+
+STAGES = ('http', 'ack', 'ack_lead', 'fill')
+TERMINAL = frozenset(['Filled', 'Canceled', 'Rejected'])
+
+# positions in an order's trace list
+SUBMIT, RESPONSE, ACK, FILL, ORDERID, DONE = range(6)
+
+class OrderLatencyTracer(object):
+
+    def __init__(self, max_pending=10000, window=1000, clock=time.perf_counter):
+        self.clock = clock
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # clOrdID -> [submit, response, ack, fill, orderID, done]
+        self.pending = collections.OrderedDict()
+        self.orderIDs = {}
+        self.stats = {stage: LatencyStats(window) for stage in STAGES}
+        self.evicted = 0
+
+    def attach(self, bitmex, ws):
+        """Trace the orders placed through bitmex as they show up on ws."""
+        bitmex.add_order_listener(self)
+        ws.add_listener(self.on_table)
+        return self
+
+    #
+    # BitMEX order listener
+    #
+    def submitted(self, clOrdID, postdict=None):
+        now = self.clock()
+        with self.lock:
+            self.pending[clOrdID] = [now, None, None, None, None, False]
+            while len(self.pending) > self.max_pending:
+                self.__forget(next(iter(self.pending)))
+                self.evicted += 1
+
+    def responded(self, clOrdID, response=None):
+        now = self.clock()
+        with self.lock:
+            times = self.pending.get(clOrdID)
+            if times is None or times[RESPONSE] is not None:
+                return
+            times[RESPONSE] = now
+            self.stats['http'].add(now - times[SUBMIT])
+            if times[ACK] is not None:
+                self.stats['ack_lead'].add(times[ACK] - now)
+            if isinstance(response, dict):
+                self.__status(clOrdID, response.get('orderID'), response.get('ordStatus'))
+            elif times[DONE]:
+                self.__forget(clOrdID)
+
+    #
+    # BitMEXWebsocket listener
+    #
+    def on_table(self, table, action, rows):
+        if table not in ('order', 'execution') or action == 'delete':
+            return
+        now = self.clock()
+        with self.lock:
+            for row in rows:
+                clOrdID = row.get('clOrdID') or self.orderIDs.get(row.get('orderID'))
+                if clOrdID not in self.pending:
+                    continue
+                self.__ack(clOrdID, now)
+                if table == 'execution' and row.get('execType') == 'Trade':
+                    self.__fill(clOrdID, now)
+                self.__status(clOrdID, row.get('orderID'), row.get('ordStatus'))
+
+    def __ack(self, clOrdID, now):
+        times = self.pending[clOrdID]
+        if times[ACK] is not None:
+            return
+        times[ACK] = now
+        self.stats['ack'].add(now - times[SUBMIT])
+        if times[RESPONSE] is not None:
+            self.stats['ack_lead'].add(now - times[RESPONSE])
+
+    def __fill(self, clOrdID, now):
+        times = self.pending[clOrdID]
+        if times[FILL] is None:
+            times[FILL] = now
+            self.stats['fill'].add(now - times[ACK])
+
+    def __status(self, clOrdID, orderID, ordStatus):
+        times = self.pending.get(clOrdID)
+        if times is None:
+            return
+        if orderID and times[ORDERID] is None:
+            times[ORDERID] = orderID
+            self.orderIDs[orderID] = clOrdID
+        # a fill ends the trace, whether or not the order is done, but
+        # the HTTP response may still be on its way
+        if ordStatus in TERMINAL or times[FILL] is not None:
+            times[DONE] = True
+        if times[DONE] and times[RESPONSE] is not None:
+            self.__forget(clOrdID)
+
+    def __forget(self, clOrdID):
+        times = self.pending.pop(clOrdID, None)
+        if times is not None and times[ORDERID] is not None:
+            self.orderIDs.pop(times[ORDERID], None)
+
+    def summary(self):
+        """{stage: LatencyStats summary}, in seconds."""
+        with self.lock:
+            return {stage: stats.summary() for stage, stats in self.stats.items()}
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# Copyright (C) 2015 Bitquant Research Laboratories (Asia) Limited
+# Released under the Simplified BSD License
+
+import threading
+import time
+
+class RateLimiter(object):
+
+    """Token bucket shared by the threads of a REST client.
+
+    Requests are let through at rate per second on average, with bursts
+    of up to burst.  A caller that finds the bucket empty reserves its
+    token anyway and sleeps until the token is due, so waiting callers
+    are served in arrival order."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.waited = 0.0
+        self.__lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take tokens, sleeping as long as needed. Returns the seconds slept."""
+        with self.__lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= tokens
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.waited += wait
+        if wait:
+            time.sleep(wait)
+        return wait
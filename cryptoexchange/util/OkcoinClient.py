@@ -3,8 +3,8 @@
 # encoding: utf-8
 #客户端调用，用于查看API返回结果
 
-from OkcoinSpotAPI import OKCoinSpot
-from OkcoinFutureAPI import OKCoinFuture
+from cryptoexchange.OkcoinSpotAPI import OKCoinSpot
+from cryptoexchange.OkcoinFutureAPI import OKCoinFuture
 
 #初始化apikey，secretkey,url
 apikey = 'XXXX'
@@ -35,6 +35,9 @@ print (okcoinSpot.depth('btc_usd'))
 #print (u' 现货批量下单 ')
 #print (okcoinSpot.batchTrade('ltc_usd','buy','[{price:0.1,amount:0.2},{price:0.1,amount:0.2}]'))
 
+#print (u' 现货批量下单(自动分块) ')
+#print (okcoinSpot.batchTradeList('ltc_usd','buy',[{'price':0.1,'amount':0.2}] * 12))
+
 #print (u' 现货取消订单 ')
 #print (okcoinSpot.cancelOrder('ltc_usd','18243073'))
 
@@ -77,6 +80,9 @@ print (okcoinSpot.depth('btc_usd'))
 #print (u'期货批量下单')
 #print (okcoinFuture.future_batchTrade('ltc_usd','this_week','[{price:0.1,amount:1,type:1,match_price:0},{price:0.1,amount:3,type:1,match_price:0}]','20'))
 
+#print (u'期货批量下单(自动分块)')
+#print (okcoinFuture.future_batchTradeList('ltc_usd','this_week',[{'price':0.1,'amount':1,'type':1,'match_price':0}] * 12,'20'))
+
 #print (u'期货取消订单')
 #print (okcoinFuture.future_cancel('ltc_usd','this_week','47231499'))
 
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Measure the fan-out latency of cryptoexchange.bitmex_shm: one process
+# publishes synthetic quotes and trades, reader processes spin on the
+# shared memory block and report how long updates took to reach them.
+
+import multiprocessing
+import os
+import sys
+import time
+
+# run from a checkout without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from cryptoexchange.bitmex_shm import MarketDataPublisher, MarketDataReader
+
+SYMBOL = 'XBTBENCH'
+
+def reader(results, seconds):
+    md = MarketDataReader(SYMBOL)
+    end = time.time() + seconds
+    while time.time() < end and not md.closed:
+        md.poll()
+        md.poll_trades()
+    results.put(md.stats())
+    md.close()
+
+def main(readers=4, seconds=3.0, rate=2000):
+    publisher = MarketDataPublisher(SYMBOL)
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=reader, args=(results, seconds))
+                 for i in range(readers)]
+    for p in processes:
+        p.start()
+    quote = {'symbol': SYMBOL, 'timestamp': '2015-12-25T12:00:00.000Z',
+             'bidPrice': 430.0, 'bidSize': 10, 'askPrice': 430.5, 'askSize': 12}
+    trade = {'symbol': SYMBOL, 'timestamp': '2015-12-25T12:00:00.000Z',
+             'price': 430.5, 'size': 3, 'side': 'Buy'}
+    end = time.time() + seconds
+    n = 0
+    while time.time() < end:
+        quote['bidPrice'] = 430.0 + n % 10
+        publisher.publish_quote(quote)
+        publisher.publish_trade(trade)
+        n += 1
+        time.sleep(1.0 / rate)
+    for i in range(readers):
+        stats = results.get()
+        for name in ('bbo', 'trade'):
+            s = stats[name]
+            if not s['count']:
+                print("reader %d %-5s count       0" % (i, name))
+                continue
+            print("reader %d %-5s count %7d  p50 %6.1f us  p99 %6.1f us  max %8.1f us" %
+                  (i, name, s['count'], s['p50'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6))
+    for p in processes:
+        p.join()
+    publisher.close()
+    print("published %d quotes and trades" % n)
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# Measure the start-up cost of importing cryptoexchange in a fresh
+# interpreter, against a bare interpreter start.
+
+import os
+import subprocess
+import sys
+import time
+
+# the timed interpreters import the package from this checkout
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+ENV = dict(os.environ, PYTHONPATH=os.pathsep.join(
+    [ROOT] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])))
+
+STATEMENTS = [
+    "pass",
+    "import cryptoexchange",
+    "from cryptoexchange import get_data",
+    "from cryptoexchange import OKCoinSpot, OKCoinFuture",
+    "from cryptoexchange import BitMEX",
+    "from cryptoexchange import BitMEXWebsocket",
+]
+
+def run(statement, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, "-c", statement], cwd=ROOT, env=ENV)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(repeat=10):
+    base = run("pass", repeat)
+    for statement in STATEMENTS:
+        try:
+            elapsed = run(statement, repeat)
+        except subprocess.CalledProcessError:
+            print("%-55s  failed" % statement)
+            continue
+        print("%-55s %7.1f ms  (+%.1f ms)" % (statement, elapsed * 1000, (elapsed - base) * 1000))
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])
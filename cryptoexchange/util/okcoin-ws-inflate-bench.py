@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# Compare OKCoin websocket frame handling throughput: the per-message
+# inflate of the demo against OKCoinWebsocket.dispatch.
+
+import json
+import os
+import sys
+import time
+import zlib
+
+# run from a checkout without installing the package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from cryptoexchange.OkcoinWebsocket import inflate, OKCoinWebsocket
+
+def frame(channel, data):
+    compress = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw = json.dumps([{'channel': channel, 'data': data}]).encode('utf-8')
+    return compress.compress(raw) + compress.flush()
+
+def rate(fn, frames):
+    start = time.perf_counter()
+    for f in frames:
+        fn(f)
+    return len(frames) / (time.perf_counter() - start)
+
+def main(n=200000):
+    tick = frame('ok_btcusd_ticker',
+                 {'buy': '2500.1', 'sell': '2500.2', 'last': '2500.1', 'high': '2600',
+                  'low': '2400', 'vol': '12345.6', 'timestamp': '1490000000000'})
+    frames = [tick] * n
+
+    def legacy(f):
+        return json.loads(inflate(f).decode('utf-8'))
+
+    client = OKCoinWebsocket()
+    client.on('ok_btcusd_ticker', lambda channel, data: None)
+
+    print("per-message inflate : %10.0f msgs/sec" % rate(legacy, frames))
+    print("OKCoinWebsocket     : %10.0f msgs/sec" % rate(client.dispatch, frames))
+
+if __name__ == "__main__":
+    main(*[int(a) for a in sys.argv[1:]])